@@ -0,0 +1,164 @@
+"""Times the grading pipeline on synthetic data.
+
+Every stage is timed on its own and the results are written as JSON, so
+that runs from different commits can be compared with --compare:
+
+    python bench/bench.py --students 500 --output before.json
+    python bench/bench.py --students 500 --compare before.json
+
+Everything runs offline on data generated into a temporary directory.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import aaps
+import main
+import report
+import resolver
+import rulecache
+import rules
+import synthetic
+import util
+
+
+def time_runs(function, repeat):
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        runs.append(time.perf_counter() - start)
+    return {
+        'min': min(runs),
+        'median': statistics.median(runs),
+        'runs': runs
+    }
+
+
+def git_revision():
+    try:
+        output = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                         stderr=subprocess.DEVNULL)
+        return output.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def grade_all(ruleset, students, program):
+    return [main.grade_student(student, ruleset, program, False) for student in students]
+
+
+def run_benchmarks(args, directory):
+    rulepath = synthetic.write_ruleset(directory, args.problems, args.weeks,
+                                       args.labs, args.sessions)
+    datapath = synthetic.write_export(os.path.join(directory, 'export.json'),
+                                      args.students, args.submissions, args.problems,
+                                      args.sessions, args.weeks, args.seed)
+
+    ruleset = rules.parse_file(rulepath)
+    rulecache.load_ruleset(rulepath, directory)
+    students = aaps.read_exported_kattis_file(datapath).students
+    program = main.compile_ruleset(ruleset)
+    graded = grade_all(ruleset, students, program)
+
+    def print_all():
+        with contextlib.redirect_stdout(io.StringIO()):
+            for student_result in graded:
+                main.print_student_result(student_result, True)
+
+    def write_all(fmt):
+        writer = report.make_writer(fmt, io.StringIO(), True)
+        util.map_now(writer.write, graded)
+        writer.finish()
+
+    stages = [
+        ('rules.parse_file', lambda: rules.parse_file(rulepath)),
+        ('rulecache.load_ruleset (warm)', lambda: rulecache.load_ruleset(rulepath, directory)),
+        ('aaps.read_exported_kattis_file', lambda: aaps.read_exported_kattis_file(datapath)),
+        ('resolver.topological_order', lambda: resolver.topological_order(ruleset.rules)),
+        ('main.compile_ruleset', lambda: main.compile_ruleset(ruleset)),
+        ('resolver.resolve', lambda: grade_all(ruleset, students, program)),
+        ('resolver.resolve (interpreted)', lambda: grade_all(ruleset, students, None)),
+        ('main.grade_students_in_cohorts',
+         lambda: list(main.grade_students_in_cohorts(students, ruleset, program))),
+        ('main.print_student_result', print_all),
+        ('report (json)', lambda: write_all('json')),
+        ('report (csv)', lambda: write_all('csv')),
+    ]
+    selected = [(name, function) for name, function in stages
+                if not args.stage or any(part in name for part in args.stage)]
+    results = {}
+    for name, function in selected:
+        results[name] = time_runs(function, args.repeat)
+        print('{:40} {:10.4f}s'.format(name, results[name]['min']), file=sys.stderr)
+    return {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'parameters': {
+            'students': args.students,
+            'submissions': args.submissions,
+            'problems': args.problems,
+            'weeks': args.weeks,
+            'labs': args.labs,
+            'sessions': args.sessions,
+            'seed': args.seed,
+            'repeat': args.repeat,
+            'rules': len(ruleset.rules),
+            'total_submissions': sum(len(s.submissions) for s in students),
+        },
+        'results': results
+    }
+
+
+def print_comparison(before, after):
+    print('{:40} {:>10} {:>10} {:>8}'.format('stage', 'before', 'after', 'change'))
+    for name, result in after['results'].items():
+        if name not in before['results']:
+            continue
+        old = before['results'][name]['min']
+        new = result['min']
+        change = (new - old) / old * 100 if old else 0
+        print('{:40} {:10.4f} {:10.4f} {:+7.1f}%'.format(name, old, new, change))
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description='Benchmark grading on synthetic data')
+    parser.add_argument('--students', type=int, default=200)
+    parser.add_argument('--submissions', type=int, default=100,
+                        help='Average number of submissions per student')
+    parser.add_argument('--problems', type=int, default=200)
+    parser.add_argument('--weeks', type=int, default=14)
+    parser.add_argument('--labs', type=int, default=4)
+    parser.add_argument('--sessions', type=int, default=6)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--stage', action='append',
+                        help='Only run stages whose name contains this, can be repeated')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    parser.add_argument('--compare', help='Compare against results from an earlier run')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        report = run_benchmarks(args, directory)
+
+    content = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(content)
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(json.load(f), report)
+    elif not args.output:
+        print(content)
+
+
+if __name__ == '__main__':
+    main_bench()
@@ -0,0 +1,48 @@
+"""Times reading the rows of saved table-submissions pages.
+
+Compares kattishtml, which only walks the submissions table, with the
+BeautifulSoup parsing that was used before, and checks that both give
+the same rows:
+
+    python bench/bench_html.py test/pages/submissions.html
+"""
+import argparse
+import json
+import sys
+
+import bench
+import kattishtml
+
+from utiltest import parse_with_soup
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description='Benchmark reading submission pages')
+    parser.add_argument('pages', nargs='+', help='Saved profile pages')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    args = parser.parse_args()
+
+    results = {}
+    for fpath in args.pages:
+        with open(fpath) as f:
+            html = f.read()
+        if parse_with_soup(html) != kattishtml.parse_submission_rows(html):
+            sys.exit('{}: the parsers do not agree'.format(fpath))
+        soup = bench.time_runs(lambda: parse_with_soup(html), args.repeat)
+        lxml = bench.time_runs(lambda: kattishtml.parse_submission_rows(html), args.repeat)
+        speedup = soup['min'] / lxml['min']
+        results[fpath] = {'soup': soup, 'kattishtml': lxml, 'speedup': speedup}
+        print('{:40} soup {:8.4f}s  kattishtml {:8.4f}s  {:5.1f}x'.format(
+            fpath, soup['min'], lxml['min'], speedup), file=sys.stderr)
+
+    content = json.dumps({'revision': bench.git_revision(), 'results': results}, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(content)
+    else:
+        print(content)
+
+
+if __name__ == '__main__':
+    main_bench()
@@ -0,0 +1,226 @@
+"""Synthetic course exports and rulesets for benchmarking.
+
+The rulesets are shaped like rules/rules.json: weekly exercises graded
+with "uppgift" and a deadline, labs without a deadline, individual and
+group sessions, and a main file that combines them with "get", "COUNT",
+"MAX", "AND" and friends. The exports have the same layout as the course
+export from Kattis, with a "students" and a "sessions" section.
+"""
+import json
+import os
+import random
+import time
+
+JUDGEMENTS = [
+    ('Accepted', 4),
+    ('Wrong Answer', 3),
+    ('Time Limit Exceeded', 1),
+    ('Run Time Error', 1),
+    ('Memory Limit Exceeded', 1),
+    ('Compile Error', 1),
+]
+
+# The course starts here, each week is one exercise with a deadline
+COURSE_START = 1548979200  # 2019-02-01 00:00 UTC
+WEEK = 7 * 24 * 60 * 60
+
+
+def problem_id(idx):
+    return 'problem{}'.format(idx)
+
+
+def deadline_string(seconds):
+    return time.strftime('%d-%m-%Y %H:%M', time.gmtime(seconds))
+
+
+def split_problems(problems, weeks, labs, sessions):
+    # Weeks get half of the problems, the rest is shared by labs and sessions
+    ids = [problem_id(idx) for idx in range(problems)]
+    half = max(weeks, len(ids) // 2)
+    week_ids, rest = ids[:half], ids[half:] or ids
+    chunk = lambda seq, parts: [seq[i::parts] for i in range(parts)]
+    lab_ids = chunk(rest, labs) if labs else []
+    session_ids = chunk(list(reversed(rest)), sessions) if sessions else []
+    return chunk(week_ids, weeks), lab_ids, session_ids
+
+
+def make_upg_rules(week_problems):
+    rules = []
+    for week, problems in enumerate(week_problems, 1):
+        deadline = deadline_string(COURSE_START + week * WEEK)
+        rules.append({
+            'name': 'Exercise {}'.format(week),
+            'towards': 'UPG1-week{}'.format(week),
+            'points': {'uppgift': {'deadline': deadline, 'problems': problems}}
+        })
+        rules.append({
+            'needs': {'>': {'lhs': {'get': 'UPG1-week{}'.format(week)}, 'rhs': 0}},
+            'towards': 'week{}-solved'.format(week),
+            'points': 1
+        })
+        if problems:
+            rules.append({
+                'name': 'Late bonus {}'.format(week),
+                'towards': 'UPG1-hard',
+                'points': {'late': {'problem': problems[0], 'deadline': deadline,
+                                    'before': 1, 'after': {'/': [1, 2]}}}
+            })
+    weeks = range(1, len(week_problems) + 1)
+    rules.append({
+        'name': 'Total UPG1 Points',
+        'towards': 'UPG1-points',
+        'points': {'+': [{'get': 'UPG1-week{}'.format(w)} for w in weeks]}
+    })
+    return rules
+
+
+def make_lab_rules(lab_problems):
+    rules = []
+    for lab, problems in enumerate(lab_problems, 1):
+        # Every third problem is worth more, like the bigger lab problems
+        items = [p if idx % 3 else {'id': p, 'points': 2} for idx, p in enumerate(problems)]
+        rules.append({
+            'name': 'Solved for Lab {}'.format(lab),
+            'towards': 'LAB1-lab{}'.format(lab),
+            'points': {'uppgift': {'problems': items}}
+        })
+    labs = range(1, len(lab_problems) + 1)
+    rules.append({
+        'name': 'Total laboration points',
+        'towards': 'LAB1-points',
+        'points': {'+': [{'get': 'LAB1-lab{}'.format(lab)} for lab in labs] or [0]}
+    })
+    return rules
+
+
+def session_goal(idx):
+    # Every third session is a group session
+    kind = 'group' if idx % 3 == 2 else 'individual'
+    return '{}-session-{}'.format(kind, idx + 1)
+
+
+def make_session_rules(session_problems):
+    rules = []
+    for idx, problems in enumerate(session_problems):
+        end = deadline_string(COURSE_START + idx * WEEK + 4 * 60 * 60)
+        rules.append({
+            'name': session_goal(idx),
+            'towards': session_goal(idx),
+            'points': {'session': {'name': session_goal(idx), 'end': end,
+                                   'problems': problems}}
+        })
+    return rules
+
+
+def make_main_rules(weeks, sessions):
+    gets = lambda goals: [{'get': goal} for goal in goals]
+    positive = lambda goal: {'>': {'lhs': {'get': goal}, 'rhs': 0}}
+    individual = [session_goal(i) for i in range(sessions) if 'individual' in session_goal(i)]
+    group = [session_goal(i) for i in range(sessions) if 'group' in session_goal(i)]
+    pairs = [{'+': gets([a, b])} for i, a in enumerate(individual) for b in individual[i + 1:]]
+    rules = [
+        {'towards': 'individual-session-two-completed', 'points': 1,
+         'needs': {'>=': {'lhs': {'COUNT': [positive(g) for g in individual] or [False]},
+                          'rhs': 2}}},
+        {'towards': 'group-session-one-completed', 'points': 1,
+         'needs': {'>=': {'lhs': {'COUNT': [positive(g) for g in group] or [False]},
+                          'rhs': 1}}},
+        {'towards': 'individual-session-score',
+         'points': {'MAX': pairs or gets(individual) or [0]}},
+        {'towards': 'group-session-score', 'points': {'MAX': gets(group) or [0]}},
+        {'towards': 'LAB1-total-points',
+         'points': {'+': gets(['individual-session-score', 'group-session-score', 'LAB1-points'])}},
+        {'towards': 'UPG1-one-each-week', 'points': 1,
+         'needs': {'AND': [positive('week{}-solved'.format(w)) for w in range(1, weeks + 1)]}},
+    ]
+    for grade, limit in [(3, 0.3), (4, 0.6), (5, 0.9)]:
+        rules.append({
+            'name': 'UPG1 - Has {}?'.format(grade), 'towards': 'UPG1',
+            'points': 3 if grade == 3 else 1,
+            'needs': {'AND': [positive('UPG1-one-each-week'),
+                              {'>=': {'lhs': {'get': 'UPG1-points'},
+                                      'rhs': int(3 * weeks * limit)}}]}
+        })
+        rules.append({
+            'name': 'LAB1 - Has {}?'.format(grade), 'towards': 'LAB1',
+            'points': 3 if grade == 3 else 1,
+            'needs': {'AND': [{'>=': {'lhs': {'get': 'LAB1-total-points'},
+                                      'rhs': 9 * grade}},
+                              positive('individual-session-two-completed'),
+                              positive('group-session-one-completed')]}
+        })
+    return rules
+
+
+def write_json(fpath, content):
+    with open(fpath, 'w') as f:
+        json.dump(content, f, indent=2)
+
+
+def write_ruleset(directory, problems=200, weeks=14, labs=4, sessions=6):
+    """Writes a ruleset split over several included files, like the course
+    rules, and returns the path to the main file."""
+    week_problems, lab_problems, session_problems = \
+        split_problems(problems, weeks, labs, sessions)
+    files = [
+        ('upg.json', make_upg_rules(week_problems)),
+        ('lab.json', make_lab_rules(lab_problems)),
+        ('sessions.json', make_session_rules(session_problems)),
+    ]
+    includes = []
+    for fname, rules in files:
+        fpath = os.path.join(directory, fname)
+        write_json(fpath, {'rules': rules})
+        includes.append(fpath)
+    main_path = os.path.join(directory, 'rules.json')
+    write_json(main_path, {'includes': includes, 'rules': make_main_rules(weeks, sessions)})
+    return main_path
+
+
+def make_submission(rng, problems, weeks):
+    judgements, weights = zip(*JUDGEMENTS)
+    seconds = COURSE_START + rng.randrange((weeks + 2) * WEEK)
+    return {
+        'problem': problem_id(rng.randrange(problems)),
+        'judgement': rng.choices(judgements, weights)[0],
+        'time': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(seconds))
+    }
+
+
+def make_session(rng, idx, usernames, problems, team_size):
+    starttime = COURSE_START + idx * WEEK
+    members = list(usernames)
+    rng.shuffle(members)
+    teams = [members[i:i + team_size] for i in range(0, len(members), team_size)]
+
+    def team_problem(problem):
+        item = {'problem_name': problem_id(problem)}
+        if rng.random() < 0.5:
+            item['solve_time'] = rng.randrange(1, 240)
+        return item
+
+    chosen = rng.sample(range(problems), min(problems, 6))
+    results = [{'members': team, 'problems': [team_problem(p) for p in chosen]}
+               for team in teams]
+    return {'starttime': str(starttime), 'results': results}
+
+
+def write_export(fpath, students=100, submissions=100, problems=200, sessions=6,
+                 weeks=14, seed=0):
+    """Writes a course export with the given number of students, each with
+    about the given number of submissions."""
+    rng = random.Random(seed)
+    usernames = ['student{}'.format(idx) for idx in range(students)]
+    json_students = []
+    for username in usernames:
+        count = rng.randint(submissions // 2, submissions * 3 // 2)
+        json_students.append({
+            'username': username,
+            'name': username.capitalize(),
+            'email': '{}@example.com'.format(username),
+            'submissions': [make_submission(rng, problems, weeks) for _ in range(count)]
+        })
+    json_sessions = [make_session(rng, idx, usernames, problems, 1 if idx % 3 != 2 else 3)
+                     for idx in range(sessions)]
+    write_json(fpath, {'students': json_students, 'sessions': json_sessions})
+    return fpath
@@ -1,22 +1,25 @@
+import array
+import calendar
 import collections
+import functools
 import util
 import time
-import json
-import colored
+import jsonstream
 
+from resolver import make_checker
 
+# The time of a submission is given in minutes since the epoch
 Submission = collections.namedtuple('Submission', 'id time result')
 
 
 def make_submission(id, time, result):
-    return Submission(id, time, result)
+    return Submission(id, as_minutes(time), result)
 
 
 def make_solved_handler(kattis):
-    def checker(context, tree):
-        return isinstance(tree, dict) and 'solved' in tree
+    checker = make_checker('solved')
     def resolver(context, tree):
-        return any(result.id == tree['solved'] for result in kattis.AC)
+        return kattis.has_solved(tree['solved'])
     return checker, resolver
 
 def time_parse(timestr):
@@ -27,25 +30,31 @@ def time_parse(timestr):
     # %M - minute [00-59]
     return time.strptime(timestr, '%d-%m-%Y %H:%M')
 
+def struct_to_minutes(time_struct):
+    # Times are compared as given, so treat them as UTC to get an ordering
+    # that is the same as comparing the fields one by one.
+    return calendar.timegm(time_struct) // 60
+
+@functools.lru_cache(maxsize=None)
+def time_minutes(timestr):
+    # Deadlines are the same few strings for every student, so each one
+    # is only parsed once.
+    return struct_to_minutes(time_parse(timestr))
+
+def as_minutes(value):
+    return time_minutes(value) if isinstance(value, str) else value
+
 def time_compare(a, b):
-    return time_parse(a) < time_parse(b)
+    return as_minutes(a) < as_minutes(b)
 
 def make_late_handler(kattis):
-    def problem_solved(problem_id):
-        return len(kattis.solutions_for(problem_id)) > 0
-
     def ac_before_deadline(problem_id, deadline):
-        return problem_solved(problem_id) and \
-            any(time_compare(solution.time, deadline)
-                for solution in kattis.solutions_for(problem_id))
+        return kattis.solved_before(problem_id, deadline)
 
     def ac_after_deadline(problem_id, deadline):
-        return problem_solved(problem_id) and \
-            all(time_compare(deadline, solution.time)
-                for solution in kattis.solutions_for(problem_id))
+        return kattis.solved_only_after(problem_id, deadline)
 
-    def checker(context, tree):
-        return isinstance(tree, dict) and 'late' in tree
+    checker = make_checker('late')
     def resolver(context, tree):
         items = tree['late']
         before = context.value_expression(items['before'])
@@ -61,36 +70,43 @@ def make_late_handler(kattis):
     return checker, resolver
 
 
-def make_uppgift_handler(kattis):
-    Problem = collections.namedtuple('Problem', 'id points')
-
-    def is_string(e):
-        return isinstance(e, str)
-    def is_dict(e):
-        return isinstance(e, dict)
-    def problem_from_string(problem_id):
-        return Problem(problem_id, 1)
-    def problem_from_dict(obj):
-        return Problem(obj['id'], obj['points'])
-    make_problem = util.cond([
-        (is_string, problem_from_string),
-        (is_dict, problem_from_dict)
-    ])
+Problem = collections.namedtuple('Problem', 'id points')
+
+# Labs do not have a deadline, so they get one about 100 years from now
+NO_DEADLINE = '01-01-2117 08:00'
+
+
+def is_string(e):
+    return isinstance(e, str)
+
+def is_dict(e):
+    return isinstance(e, dict)
 
+def problem_from_string(problem_id):
+    return Problem(problem_id, 1)
+
+def problem_from_dict(obj):
+    return Problem(obj['id'], obj['points'])
+
+make_problem = util.cond([
+    (is_string, problem_from_string),
+    (is_dict, problem_from_dict)
+])
+
+
+def make_uppgift_handler(kattis):
     def count_for_single_problem(problem, deadline):
-        solutions = kattis.solutions_for(problem.id)
-        problem_solved = len(solutions) > 0
-        before_deadline = problem_solved and any(time_compare(s.time, deadline) for s in solutions)
+        problem_solved = kattis.has_solved(problem.id)
+        before_deadline = kattis.solved_before(problem.id, deadline)
         return (0.5 * problem_solved + 0.5 * before_deadline) * problem.points
 
-    def checker(context, tree):
-        return isinstance(tree, dict) and 'uppgift' in tree
+    checker = make_checker('uppgift')
 
     def resolver(context, tree):
         # If a problem does not have a deadline, then assume it is a lab
         # and move the deadline to something like 100 years from now.
         problems = util.map_now(make_problem, tree['uppgift']['problems'])
-        deadline = tree['uppgift'].get('deadline', '01-01-2117 08:00')
+        deadline = tree['uppgift'].get('deadline', NO_DEADLINE)
         points = lambda problem: count_for_single_problem(problem, deadline)
         return sum(map(points, problems))
 
@@ -99,11 +115,10 @@ def make_uppgift_handler(kattis):
 
 def make_session_handler(kattis):
     def count_for_single_problem(name, problem, deadline):
-        solutions = kattis.solutions_for(problem)
-        problem_solved = len(solutions) > 0
-        return 3 * problem_solved
+        return 3 * kattis.has_solved(problem)
 
     def input_for_single_problem(name, problem, deadline):
+        import colored
         red = colored.fg('red')
         white = colored.fg('white')
         reset = colored.attr('reset')
@@ -119,8 +134,7 @@ def make_session_handler(kattis):
     }
     problem_handler = choice[kattis.count_session_with_input]
 
-    def checker(context, tree):
-        return isinstance(tree, dict) and 'session' in tree
+    checker = make_checker('session')
 
     def resolver(context, tree):
         name = tree['session']['name']
@@ -129,65 +143,206 @@ def make_session_handler(kattis):
         points = lambda problem: problem_handler(name, problem, deadline)
         return sum(map(points, problems))
 
+    # Every session question has to be asked, so no answer is reused
+    resolver.impure = kattis.count_session_with_input
     return checker, resolver
 
 
+VERDICTS = ['AC', 'WA', 'TLE', 'MLE', 'RTE']
+FAILS = ['WA', 'TLE', 'MLE', 'RTE']
+
+
+##########################################
+# Submission storage                     #
+##########################################
+
+# Exports can hold millions of submissions, so they are stored as columns
+# of small numbers instead of one tuple each. Problem ids and results are
+# interned to numbers that are shared by every student in the process.
+
+
+class InternTable:
+
+    def __init__(self, values=()):
+        self.values = []
+        self.numbers = {}
+        util.map_now(lambda value: intern_value(self, value), values)
+
+
+def intern_value(table, value):
+    number = table.numbers.get(value)
+    if number is None:
+        number = len(table.values)
+        table.values.append(value)
+        table.numbers[value] = number
+    return number
+
+
+PROBLEM_IDS = InternTable()
+RESULTS = InternTable(VERDICTS)
+
+
+class SubmissionList:
+    """The submissions of a student, with the problem, the time in
+    minutes and the result of each as a column of numbers. Reading gives
+    Submission tuples, so it can be used like a list of them."""
+    __slots__ = ('problems', 'times', 'results')
+
+    def __init__(self, submissions=()):
+        self.problems = array.array('I')
+        self.times = array.array('q')
+        self.results = array.array('B')
+        util.map_now(self.append, submissions)
+
+    def append(self, submission):
+        self.problems.append(intern_value(PROBLEM_IDS, submission.id))
+        self.times.append(submission.time)
+        self.results.append(intern_value(RESULTS, submission.result))
+
+    def __len__(self):
+        return len(self.times)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return Submission(PROBLEM_IDS.values[self.problems[index]], self.times[index],
+                          RESULTS.values[self.results[index]])
+
+    def __iter__(self):
+        return map(self.__getitem__, range(len(self)))
+
+    def __eq__(self, other):
+        if not isinstance(other, (list, SubmissionList)):
+            return NotImplemented
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def __reduce__(self):
+        # The numbers only mean something in this process, so the
+        # submissions are sent to other processes as tuples
+        return SubmissionList, (list(self),)
+
+
+##########################################
+# Kattis results                         #
+##########################################
+
+
 class KattisResult:
 
     def __init__(self):
-        self.AC = []
-        self.WA = []
-        self.TLE = []
-        self.MLE = []
-        self.RTE = []
+        # The submissions with a listed verdict, and the positions in them
+        # of the submissions for every problem, kept up to date as they are
+        # added so lookups never scan all of them.
+        self.submissions = SubmissionList()
+        self.problems = {}
+        self.first_AC = {}
         self.count_session_with_input = False
 
+    AC = property(lambda self: self.submissions_with('AC'))
+    WA = property(lambda self: self.submissions_with('WA'))
+    TLE = property(lambda self: self.submissions_with('TLE'))
+    MLE = property(lambda self: self.submissions_with('MLE'))
+    RTE = property(lambda self: self.submissions_with('RTE'))
+
     def resolve_sessions_with_input(self):
         self.count_session_with_input = True
 
     def add_AC(self, id, time):
-        self.AC.append(make_submission(id, time, 'AC'))
+        self.add_submission(make_submission(id, time, 'AC'))
 
     def add_WA(self, id, time):
-        self.WA.append(make_submission(id, time, 'WA'))
+        self.add_submission(make_submission(id, time, 'WA'))
 
     def add_TLE(self, id, time):
-        self.TLE.append(make_submission(id, time, 'TLE'))
+        self.add_submission(make_submission(id, time, 'TLE'))
 
     def add_MLE(self, id, time):
-        self.MLE.append(make_submission(id, time, 'MLE'))
+        self.add_submission(make_submission(id, time, 'MLE'))
 
     def add_RTE(self, id, time):
-        self.RTE.append(make_submission(id, time, 'RTE'))
+        self.add_submission(make_submission(id, time, 'RTE'))
 
     def add_submission(self, submission):
-        array_choser = {
-            'AC': self.AC,
-            'WA': self.WA,
-            'TLE': self.TLE,
-            'MLE': self.MLE,
-            'RTE': self.RTE
-        }
         # Discard compile errors and judgements not listed
-        array = array_choser.get(submission.result, [])
-        array.append(submission)
+        if submission.result not in VERDICTS:
+            return
+        self.problem_positions(submission.id).append(len(self.submissions))
+        self.submissions.append(submission)
+        if submission.result == 'AC':
+            self.update_first_AC(submission)
+
+    def add_submission_list(self, submissions):
+        # Same as adding the submissions one by one, but copies the
+        # columns without making a tuple of each submission
+        listed = set(map(RESULTS.numbers.get, VERDICTS))
+        accepted = RESULTS.numbers['AC']
+        columns = zip(submissions.problems, submissions.times, submissions.results)
+        for problem, time, result in columns:
+            if result not in listed:
+                continue
+            problem_id = PROBLEM_IDS.values[problem]
+            self.problem_positions(problem_id).append(len(self.submissions.times))
+            self.submissions.problems.append(problem)
+            self.submissions.times.append(time)
+            self.submissions.results.append(result)
+            if result == accepted:
+                first = self.first_AC.get(problem_id)
+                if first is None or time < first:
+                    self.first_AC[problem_id] = time
+
+    def problem_positions(self, problem_id):
+        positions = self.problems.get(problem_id)
+        if positions is None:
+            positions = array.array('I')
+            self.problems[problem_id] = positions
+        return positions
+
+    def submissions_with(self, verdict):
+        code = RESULTS.numbers[verdict]
+        return [submission for submission, result in zip(self.submissions, self.submissions.results)
+                if result == code]
+
+    def update_first_AC(self, submission):
+        first = self.first_AC.get(submission.id)
+        if first is None or submission.time < first:
+            self.first_AC[submission.id] = submission.time
+
+    def submissions_for(self, problem_id, verdict):
+        code = RESULTS.numbers[verdict]
+        results = self.submissions.results
+        positions = self.problems.get(problem_id, ())
+        return [self.submissions[p] for p in positions if results[p] == code]
 
     def solutions_for(self, problem_id):
-        return util.filter_now(lambda s: s.id == problem_id, self.AC)
+        return self.submissions_for(problem_id, 'AC')
 
     def WA_for(self, problem_id):
-        return util.filter_now(lambda s: s.id == problem_id, self.WA)
+        return self.submissions_for(problem_id, 'WA')
+
+    def WA_count_for(self, problem_id):
+        code = RESULTS.numbers['WA']
+        results = self.submissions.results
+        return sum(1 for p in self.problems.get(problem_id, ()) if results[p] == code)
 
     def fails_for(self, problem_id):
-        same_id = lambda sub: sub.id == problem_id
-        return util.filter_now(same_id, self.WA) + \
-            util.filter_now(same_id, self.TLE) + \
-            util.filter_now(same_id, self.MLE) + \
-            util.filter_now(same_id, self.RTE)
+        fails = lambda verdict: self.submissions_for(problem_id, verdict)
+        return sum(map(fails, FAILS), [])
 
     def attempts_for(self, problem_id):
         return self.solutions_for(problem_id) + self.fails_for(problem_id)
 
+    def has_attempted(self, problem_id):
+        return problem_id in self.problems
+
+    def has_solved(self, problem_id):
+        return problem_id in self.first_AC
+
+    def first_AC_for(self, problem_id):
+        return self.first_AC.get(problem_id)
+
     def get_plugins(self):
         return [
             make_solved_handler(self),
@@ -197,14 +352,104 @@ class KattisResult:
         ]
 
     def solved_before(self, problem, deadline):
-        solutions = self.solutions_for(problem)
-        return any(time_compare(sol.time, deadline) for sol in solutions)
+        first = self.first_AC_for(problem)
+        return first is not None and time_compare(first, deadline)
+
+    def solved_only_after(self, problem, deadline):
+        first = self.first_AC_for(problem)
+        return first is not None and time_compare(deadline, first)
+
+##########################################
+# Cohort                                 #
+##########################################
+
+# Evaluates the uppgift and late expressions for a group of students at
+# once. The first AC of every student is kept per problem, so an
+# expression only looks at the students that have solved its problems.
+# Each student is then resolved as usual, with plugins that look up the
+# value of the student in the columns.
+
+LATE_BEFORE = 0
+LATE_AFTER = 1
+LATE_NONE = 2
+
+
+class Cohort:
+
+    def __init__(self, size):
+        self.size = size
+        # problem id -> student index -> time of the first AC
+        self.first_AC = collections.defaultdict(dict)
+        # id of an expression -> its value or state for every student
+        self.columns = {}
+
+
+def make_cohort(kattis_results):
+    cohort = Cohort(len(kattis_results))
+    for index, kattis in enumerate(kattis_results):
+        for problem_id, first in kattis.first_AC.items():
+            cohort.first_AC[problem_id][index] = first
+    return cohort
+
+
+def cohort_column(cohort, tree, compute):
+    # Expressions are kept alive by the ruleset, so their ids are stable
+    column = cohort.columns.get(id(tree))
+    if column is None:
+        column = compute(cohort, tree)
+        cohort.columns[id(tree)] = column
+    return column
+
+
+def uppgift_column(cohort, tree):
+    # Same sum as the uppgift handler, in the same order. Unsolved problems
+    # add nothing, but any problem at all makes the sum a float.
+    items = tree['uppgift']
+    problems = util.map_now(make_problem, items['problems'])
+    deadline = as_minutes(items.get('deadline', NO_DEADLINE))
+    values = [0.0 if problems else 0] * cohort.size
+    for problem in problems:
+        for index, first in cohort.first_AC.get(problem.id, {}).items():
+            values[index] += (0.5 + 0.5 * (first < deadline)) * problem.points
+    return values
+
+
+def late_column(cohort, tree):
+    items = tree['late']
+    deadline = as_minutes(items['deadline'])
+    states = [LATE_NONE] * cohort.size
+    for index, first in cohort.first_AC.get(items['problem'], {}).items():
+        states[index] = util.cond([
+            (lambda: first < deadline, util.constant(LATE_BEFORE)),
+            (lambda: deadline < first, util.constant(LATE_AFTER)),
+            (util.truthy, util.constant(LATE_NONE))
+        ])()
+    return states
+
+
+def cohort_plugins(cohort, index):
+    # Plugins for the student at index, added after the plugins of the
+    # student's KattisResult so that they take over uppgift and late.
+    def uppgift_resolver(context, tree):
+        return cohort_column(cohort, tree, uppgift_column)[index]
+
+    def late_resolver(context, tree):
+        items = tree['late']
+        points = [context.value_expression(items['before']),
+                  context.value_expression(items['after']), 0]
+        return points[cohort_column(cohort, tree, late_column)[index]]
+
+    return [
+        (make_checker('late'), late_resolver),
+        (make_checker('uppgift'), uppgift_resolver)
+    ]
+
 
 Student = collections.namedtuple('Student', 'username name email submissions')
 
 
 def make_student(username, name, email=''):
-    return Student(username, name, email, [])
+    return Student(username, name, email, SubmissionList())
 
 
 def student_add_submission(student, submission):
@@ -222,76 +467,67 @@ def exported_kattis_add_student(data, student):
     data.students.append(student)
 
 
-def read_exported_kattis_file(fpath):
-    with open(fpath, 'r') as fp:
-        content = json.load(fp)
-    json_students = content['students']
-
-    def normalize_time(timestr):
-        # Time is given in two different ways. Eiter '%Y-%m-%d %H:%M:%S'
-        # or '%H:%M:%S' and in the latter it is supposed to be today.
-        items = timestr.split('-')
-        if len(items) <= 1:
-            # Add date in front, it is the date for today
-            today = time.localtime()
-            return '{}-{}-{} {}'.format(today.tm_year, today.tm_mon,
-                                        today.tm_mday, timestr)
-        return timestr
-
-    def json_to_submission(submission):
-        problem_id = submission['problem']
-        judgement = submission['judgement']
-        subtime = normalize_time(submission['time'])
-        judgement_translation_map = {
-            'Wrong Answer': 'WA',
-            'Time Limit Exceeded': 'TLE',
-            'Accepted': 'AC',
-            'Run Time Error': 'RTE',
-            'Memory Limit Exceeded': 'MLE',
-        }
-        inputtimeformat = '%Y-%m-%d %H:%M:%S'
-        time_struct = time.strptime(subtime, inputtimeformat)
-        year, month, day, hour, minute = time_struct[:5]
-        output_time = '{}-{}-{} {}:{}'.format(day, month, year, hour, minute)
-        result = judgement_translation_map.get(judgement, '')
-        return make_submission(problem_id, output_time, result)
-
-    def json_to_student(root):
-        username = root.get('username', '[No Username]')
-        name = root.get('name', '[No Name]')
-        email = root.get('email', '')
-        json_submissions = root.get('submissions', [])
-        submissions = util.map_now(json_to_submission, json_submissions)
-        student = make_student(username, name, email)
-        add_sub = lambda sub: student_add_submission(student, sub)
-        util.map_now(add_sub, submissions)
-        return student
+def normalize_time(timestr):
+    # Time is given in two different ways. Eiter '%Y-%m-%d %H:%M:%S'
+    # or '%H:%M:%S' and in the latter it is supposed to be today.
+    items = timestr.split('-')
+    if len(items) <= 1:
+        # Add date in front, it is the date for today
+        today = time.localtime()
+        return '{}-{}-{} {}'.format(today.tm_year, today.tm_mon,
+                                    today.tm_mday, timestr)
+    return timestr
+
+
+def json_to_submission(submission):
+    problem_id = submission['problem']
+    judgement = submission['judgement']
+    subtime = normalize_time(submission['time'])
+    judgement_translation_map = {
+        'Wrong Answer': 'WA',
+        'Time Limit Exceeded': 'TLE',
+        'Accepted': 'AC',
+        'Run Time Error': 'RTE',
+        'Memory Limit Exceeded': 'MLE',
+    }
+    inputtimeformat = '%Y-%m-%d %H:%M:%S'
+    time_struct = time.strptime(subtime, inputtimeformat)
+    result = judgement_translation_map.get(judgement, '')
+    return make_submission(problem_id, struct_to_minutes(time_struct), result)
+
+
+def json_to_student_header(root):
+    # The student without any submissions
+    username = root.get('username', '[No Username]')
+    name = root.get('name', '[No Name]')
+    email = root.get('email', '')
+    return make_student(username, name, email)
+
+
+def json_to_student(root):
+    json_submissions = root.get('submissions', [])
+    submissions = util.map_now(json_to_submission, json_submissions)
+    student = json_to_student_header(root)
+    add_sub = lambda sub: student_add_submission(student, sub)
+    util.map_now(add_sub, submissions)
+    return student
 
-    result = make_exported_kattis()
-    students = util.map_now(json_to_student, json_students)
-    add_student = lambda student: exported_kattis_add_student(result, student)
-    util.map_now(add_student, students)
 
-    def solve_time(starttime, solvetime):
-        solvetime_in_s = solvetime * 60
-        t = time.ctime(starttime + solvetime_in_s)
-        year, month, day, hour, minute = t[:5]
-        return '{}-{}-{} {}:{}'.format(day, month, year, hour, minute)
+def get_session_submissions(sessions):
+    # Returns the problems solved during sessions as accepted submissions,
+    # grouped by the username of each team member.
+    by_username = collections.defaultdict(list)
 
     def add_session_problem(student, problem, starttime):
-        timestr = solve_time(starttime, problem['solve_time'])
+        subtime = starttime + problem['solve_time']
         problem_id = problem['problem_name']
-        submission = make_submission(problem_id, timestr, 'AC')
-        student_add_submission(student, submission)
+        submission = make_submission(problem_id, subtime, 'AC')
+        by_username[student].append(submission)
 
     def add_student_session_problems(starttime, student, problems):
-        is_student = lambda s: s.username == student
-        student_data = util.find(is_student, result.students)
-        student_not_exist = util.constant(not bool(student_data))
         is_solved = lambda problem: 'solve_time' in problem
-        add_problem = lambda problem: add_session_problem(student_data, problem, starttime)
+        add_problem = lambda problem: add_session_problem(student, problem, starttime)
         handle_single_problem = util.cond([
-            (student_not_exist, util.noop),
             (is_solved, add_problem)
         ])
         util.map_now(handle_single_problem, problems)
@@ -303,12 +539,65 @@ def read_exported_kattis_file(fpath):
         util.map_now(add_for_student, members)
 
     def add_session(session):
-        # starttime in seconds since epoch
-        starttime = int(session['starttime'])
+        # starttime in seconds since epoch, converted once to local minutes
+        # so that the solve time (in minutes) can simply be added to it.
+        starttime = struct_to_minutes(time.localtime(int(session['starttime'])))
         results = session['results']
         add_team = lambda result: add_team_result(starttime, result)
         util.map_now(add_team, results)
 
-    util.map_now(add_session, content['sessions'])
+    util.map_now(add_session, sessions)
+    return by_username
 
+
+def read_exported_sessions(fpath):
+    # The students are skipped one at a time, so only the sessions are
+    # ever held in memory.
+    with open(fpath, 'r') as fp:
+        stream = jsonstream.JsonStream(fp)
+        for key in stream.iterate_object():
+            if key == 'sessions':
+                return stream.read_value()
+            jsonstream.skip_value(stream)
+    return []
+
+
+def iterate_exported_kattis_file(fpath, include=util.truthy):
+    # Yields the students one at a time with their session problems added.
+    # The file is read twice, first for the sessions and then for the
+    # students, so that the students never have to be held in memory.
+    # Students for which include(username, name) is false are skipped
+    # before their submissions are parsed.
+    session_submissions = get_session_submissions(read_exported_sessions(fpath))
+    merged_usernames = set()
+
+    def take_session_submissions(username):
+        # Only the first student with a username gets the session problems
+        is_first = username not in merged_usernames
+        merged_usernames.add(username)
+        return session_submissions.get(username, []) if is_first else []
+
+    def to_student(root, submissions):
+        student = json_to_student(root)
+        add_sub = lambda sub: student_add_submission(student, sub)
+        util.map_now(add_sub, submissions)
+        return student
+
+    with open(fpath, 'r') as fp:
+        stream = jsonstream.JsonStream(fp)
+        for key in stream.iterate_object():
+            if key != 'students':
+                jsonstream.skip_value(stream)
+                continue
+            for root in stream.iterate_array():
+                student = json_to_student_header(root)
+                submissions = take_session_submissions(student.username)
+                if include(student.username, student.name):
+                    yield to_student(root, submissions)
+
+
+def read_exported_kattis_file(fpath):
+    result = make_exported_kattis()
+    add_student = lambda student: exported_kattis_add_student(result, student)
+    util.map_now(add_student, iterate_exported_kattis_file(fpath))
     return result
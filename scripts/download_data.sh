@@ -1,4 +1,4 @@
 source venv/bin/activate
 export PYTHONPATH=./src:./plugins
-echo "Downloading your kattis data and putting it in data/my-data.json"
-python src/scrape.py > data/my-data.json
+echo "Downloading your new kattis data and adding it to data/my-data.json"
+python src/scrape.py --since-last --output data/my-data.json
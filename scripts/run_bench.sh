@@ -0,0 +1,2 @@
+export PYTHONPATH=./src:./plugins:./bench
+python bench/bench.py $@
@@ -0,0 +1,3 @@
+source venv/bin/activate
+export PYTHONPATH=./src:./plugins
+python src/daemon.py --data data/AAPS-AAPS18_export_all.json --rules rules/rules.json $@
@@ -0,0 +1,316 @@
+import aaps
+import gradecache
+import main
+import report
+import rules
+import util
+
+import argparse
+import collections
+import http.server
+import json
+import os
+import socketserver
+import stat
+import sys
+import threading
+import urllib.parse
+
+# Keeps the rules and the graded students of an export in memory and
+# answers queries about them over HTTP, on a local port or a unix socket.
+# The files are polled for changes, a new export only regrades the
+# students whose submissions changed.
+
+
+##########################################
+# State                                  #
+##########################################
+
+
+class GradingState:
+
+    def __init__(self, rulepath, datapath, use_cache=True, cache_directory=None):
+        self.rulepath = rulepath
+        self.datapath = datapath
+        self.use_cache = use_cache
+        self.cache_directory = cache_directory
+        self.ruleset = None
+        self.program = None
+        self.cache = None
+        # fpath -> modification time when the file was last loaded
+        self.rule_mtimes = {}
+        self.data_mtime = None
+        # username -> (student key, student result), in export order
+        self.results = {}
+        # (username, detailed) -> result as plain data
+        self.rendered = {}
+        # Held by queries and while new results are swapped in
+        self.lock = threading.Lock()
+        # Held for a whole refresh, only one runs at a time
+        self.refresh_lock = threading.Lock()
+
+
+# The rules as loaded by a refresh, swapped into the state with the results
+LoadedRules = collections.namedtuple('LoadedRules', 'ruleset program cache mtimes')
+
+
+def make_grading_state(rulepath, datapath, use_cache=True, cache_directory=None):
+    return GradingState(rulepath, datapath, use_cache, cache_directory)
+
+
+def file_mtime(fpath):
+    try:
+        return os.stat(fpath).st_mtime_ns
+    except OSError:
+        return None
+
+
+def file_mtimes(fpaths):
+    return {fpath: file_mtime(fpath) for fpath in fpaths}
+
+
+def rules_changed(state):
+    return not state.rule_mtimes or \
+        file_mtimes(state.rule_mtimes) != state.rule_mtimes
+
+
+def data_changed(state):
+    return state.data_mtime is None or file_mtime(state.datapath) != state.data_mtime
+
+
+def load_rules(state):
+    # Read the modification times first, a file changed while it is parsed
+    # is then loaded again on the next refresh.
+    mtimes = file_mtimes(rules.get_rule_files(state.rulepath))
+    ruleset = rules.parse_file(state.rulepath)
+    cache = util.crossroad(
+        lambda: state.use_cache,
+        lambda: main.open_grade_cache(state.rulepath, ruleset, state.cache_directory),
+        util.constant(None))
+    return LoadedRules(ruleset, main.compile_ruleset(ruleset), cache, mtimes)
+
+
+def current_rules(state):
+    return LoadedRules(state.ruleset, state.program, state.cache, state.rule_mtimes)
+
+
+def grade_student(loaded, student):
+    student_result = main.grade_student(student, loaded.ruleset, loaded.program, False,
+                                        loaded.cache)
+    util.cond([
+        (lambda: loaded.cache is not None,
+         lambda: gradecache.grade_cache_put(loaded.cache, student, student_result.result))
+    ])()
+    # The context with the plugins and their memo is not needed for the
+    # queries, and would be kept for every student as long as the daemon runs
+    return student_result._replace(context=None)
+
+
+def load_students(datapath, loaded, previous):
+    """Reads the export and grades the students that are new or whose
+    submissions changed since the previous results. Returns the results
+    and the usernames of the regraded students."""
+    results = {}
+    regraded = set()
+    for student in aaps.iterate_exported_kattis_file(datapath):
+        if student.username in results:
+            continue
+        key = gradecache.student_key(student)
+        entry = previous.get(student.username)
+        if entry is not None and entry[0] == key:
+            results[student.username] = entry
+            continue
+        results[student.username] = (key, grade_student(loaded, student))
+        regraded.add(student.username)
+    return results, regraded
+
+
+def refresh_state(state):
+    """Loads whatever changed since the last refresh. Queries are answered
+    from the old results until the new ones are swapped in. Returns the
+    number of regraded students."""
+    with state.refresh_lock:
+        reload_rules = rules_changed(state)
+        if not reload_rules and not data_changed(state):
+            return 0
+        loaded = load_rules(state) if reload_rules else current_rules(state)
+        mtime = file_mtime(state.datapath)
+        # Everyone is graded again with new rules
+        previous = {} if reload_rules else state.results
+        results, regraded = load_students(state.datapath, loaded, previous)
+
+        is_fresh = lambda key: key[0] in results and key[0] not in regraded
+        with state.lock:
+            state.ruleset, state.program, state.cache, state.rule_mtimes = loaded
+            state.rendered = {} if reload_rules else \
+                {key: value for key, value in state.rendered.items() if is_fresh(key)}
+            state.results = results
+            state.data_mtime = mtime
+        util.cond([
+            (lambda: loaded.cache is not None,
+             lambda: gradecache.save_grade_cache(loaded.cache))
+        ])()
+        return len(regraded)
+
+
+def render_student(state, username, detailed):
+    key = (username, detailed)
+    if key not in state.rendered:
+        student_result = state.results[username][1]
+        state.rendered[key] = report.student_result_to_dict(student_result, detailed)
+    return state.rendered[key]
+
+
+def state_get_grades(state, detailed=False):
+    with state.lock:
+        return [render_student(state, username, detailed) for username in state.results]
+
+
+def state_get_grade(state, username, detailed=False):
+    with state.lock:
+        if username not in state.results:
+            return None
+        return render_student(state, username, detailed)
+
+
+def state_get_status(state):
+    with state.lock:
+        return {
+            'rules': state.rulepath,
+            'data': state.datapath,
+            'students': len(state.results),
+        }
+
+
+def watch_state(state, interval, stop):
+    while not stop.wait(interval):
+        try:
+            regraded = refresh_state(state)
+        except Exception as error:
+            # Most likely a file that is still being written or a malformed
+            # export, the old results are kept and the files are read again
+            # next time.
+            print('Could not reload: {}: {}'.format(type(error).__name__, error),
+                  file=sys.stderr)
+            continue
+        if regraded:
+            print('Regraded {} students'.format(regraded), file=sys.stderr)
+
+
+##########################################
+# Server                                 #
+##########################################
+
+# GET /status              -> the loaded files and the number of students
+# GET /grades              -> every graded student
+# GET /grades/<username>   -> one graded student
+# Add ?detailed=1 to get the rules and problems behind each goal.
+
+
+def is_detailed(query):
+    return query.get('detailed', ['0'])[0].lower() not in ('', '0', 'false', 'no')
+
+
+def make_handler(state, verbose=False):
+
+    class GradingHandler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def address_string(self):
+            # Clients on a unix socket do not have an address
+            return self.client_address[0] if self.client_address else 'local'
+
+        def log_message(self, *args):
+            if verbose:
+                super().log_message(*args)
+
+        def send_json(self, status, content):
+            body = json.dumps(content).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urllib.parse.urlsplit(self.path)
+            detailed = is_detailed(urllib.parse.parse_qs(url.query))
+            parts = [urllib.parse.unquote(part) for part in url.path.split('/') if part]
+            not_found = lambda: self.send_json(404, {'error': 'Not found'})
+            if parts == ['status']:
+                return self.send_json(200, state_get_status(state))
+            if parts == ['grades']:
+                return self.send_json(200, state_get_grades(state, detailed))
+            if len(parts) != 2 or parts[0] != 'grades':
+                return not_found()
+            grade = state_get_grade(state, parts[1], detailed)
+            util.crossroad(lambda: grade is None,
+                           not_found,
+                           lambda: self.send_json(200, grade))
+
+    return GradingHandler
+
+
+class GradingServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+class UnixGradingServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(handler, port=None, socket_path=None, host='127.0.0.1'):
+    if socket_path is None:
+        return GradingServer((host, port or 0), handler)
+    # A socket left behind by an earlier run would stop the bind, anything
+    # else at the path is most likely a mistake and is left alone
+    mode = os.lstat(socket_path).st_mode if os.path.lexists(socket_path) else None
+    if mode is not None and not stat.S_ISSOCK(mode):
+        sys.exit('Not listening on {}, it exists and is not a socket'.format(socket_path))
+    if mode is not None:
+        os.remove(socket_path)
+    server = UnixGradingServer(socket_path, handler)
+    # Only the user running the daemon may read the grades
+    os.chmod(socket_path, 0o600)
+    return server
+
+
+def serve(rulepath, datapath, port=8095, socket_path=None, interval=2.0,
+          use_cache=True, cache_directory=None, verbose=False):
+    state = make_grading_state(rulepath, datapath, use_cache, cache_directory)
+    print('Graded {} students'.format(refresh_state(state)), file=sys.stderr)
+    stop = threading.Event()
+    watcher = threading.Thread(target=watch_state, args=(state, interval, stop), daemon=True)
+    watcher.start()
+    server = make_server(make_handler(state, verbose), port, socket_path)
+    print('Listening on {}'.format(socket_path or 'http://127.0.0.1:{}'.format(port)),
+          file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        server.server_close()
+        util.cond([
+            (lambda: socket_path is not None, lambda: os.remove(socket_path))
+        ])()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve the grades of a Kattis export')
+    parser.add_argument('--data', help='Data to read from')
+    parser.add_argument('--rules', help='Rules to use for judging')
+    parser.add_argument('--port', type=int, default=8095, help='Local port to listen on')
+    parser.add_argument('--socket', help='Listen on this unix socket instead of a port')
+    parser.add_argument('--interval', type=float, default=2.0,
+                        help='Seconds between checking the files for changes')
+    parser.add_argument('--no-cache', action='store_const', const=True, default=False,
+                        help='Do not read or store cached results')
+    parser.add_argument('--cache-dir', help='Where to keep cached results')
+    parser.add_argument('--verbose', action='store_const', const=True, default=False,
+                        help='Log every request')
+    args = parser.parse_args()
+    serve(args.rules, args.data, port=args.port, socket_path=args.socket,
+          interval=args.interval, use_cache=not args.no_cache,
+          cache_directory=args.cache_dir, verbose=args.verbose)
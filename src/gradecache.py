@@ -0,0 +1,139 @@
+import os
+import resolver
+import rules
+import sys
+import util
+
+
+# Bump when the layout of the cached results changes
+CACHE_VERSION = 2
+
+# hashlib and pickle are imported where they are used, students never
+# use the cache and should not wait for them.
+
+
+##########################################
+# Fingerprints                           #
+##########################################
+
+
+def hash_files(hasher, fpaths):
+    def add_file(fpath):
+        hasher.update(fpath.encode('utf-8'))
+        with open(fpath, 'rb') as f:
+            hasher.update(f.read())
+    util.map_now(add_file, sorted(set(map(os.path.abspath, fpaths))))
+
+
+def ruleset_fingerprint(rulepath, modules, rule_files=None):
+    # Results depend on every included rule file and on the code of the
+    # resolver and the plugins, given as modules, so all of them are hashed.
+    # The rule files are looked up from rulepath unless they are given.
+    import hashlib
+    hasher = hashlib.sha256()
+    hasher.update(str(CACHE_VERSION).encode('utf-8'))
+    hash_files(hasher, rule_files or rules.get_rule_files(rulepath))
+    hash_files(hasher, [module.__file__ for module in modules])
+    return hasher.hexdigest()
+
+
+def student_key(student):
+    import hashlib
+    content = repr((student.username, student.name, student.submissions))
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+##########################################
+# Cache                                  #
+##########################################
+
+
+class GradeCache:
+
+    def __init__(self, fpath, entries, ruleset=None):
+        self.fpath = fpath
+        # username -> (student key, encoded result), only the latest result
+        # for each student is kept so the cache does not grow with every
+        # export. Results are kept encoded, so the cache does not hold the
+        # goals of every graded student until it is saved.
+        self.entries = entries
+        self.changed = False
+        # Encoded results refer to the rules of the ruleset by their index
+        self.rules = [] if ruleset is None else ruleset.rules
+        self.rule_indices = make_rule_indices(self.rules)
+
+
+def make_rule_indices(rules):
+    return {id(rule): index for index, rule in enumerate(rules)}
+
+
+def encode_goals(rule_indices, result):
+    # The goals of result as plain data, with every rule as its index
+    index = lambda rule: rule_indices[id(rule)]
+    return [(goal.id, goal.name, goal.points,
+             [(index(rule), points) for rule, points in goal.resolved_rules],
+             util.map_now(index, goal.non_resolved_rules))
+            for goal in result.goals]
+
+
+def decode_goal(rules, goal_id, name, points, resolved_rules, non_resolved_rules):
+    goal = resolver.make_goal(goal_id, name)
+    goal.points = points
+    goal.resolved_rules = [(rules[index], points) for index, points in resolved_rules]
+    goal.non_resolved_rules = [rules[index] for index in non_resolved_rules]
+    return goal
+
+
+def decode_goals(rules, goals):
+    result = resolver.Result()
+    decoded = util.starmap_now(lambda *goal: decode_goal(rules, *goal), goals)
+    util.map_now(lambda goal: resolver.result_add_goal(result, goal), decoded)
+    return result
+
+
+def encode_result(cache, result):
+    import pickle
+    return pickle.dumps(encode_goals(cache.rule_indices, result), pickle.HIGHEST_PROTOCOL)
+
+
+def decode_result(cache, content):
+    import pickle
+    return decode_goals(cache.rules, pickle.loads(content))
+
+
+def grade_cache_path(directory, fingerprint):
+    return os.path.join(directory, 'grades-{}.pickle'.format(fingerprint))
+
+
+def load_grade_cache(fpath, ruleset=None):
+    """Returns the cache stored at fpath, for results of ruleset"""
+    # A missing or unreadable cache means everyone is graded again
+    return GradeCache(fpath, util.read_pickle(fpath, {}), ruleset)
+
+
+def grade_cache_get(cache, student):
+    entry = cache.entries.get(student.username)
+    is_valid = entry is not None and entry[0] == student_key(student)
+    return decode_result(cache, entry[1]) if is_valid else None
+
+
+def grade_cache_put(cache, student, result):
+    key = student_key(student)
+    entry = cache.entries.get(student.username)
+    if entry is not None and entry[0] == key:
+        return
+    cache.entries[student.username] = (key, encode_result(cache, result))
+    cache.changed = True
+
+
+def save_grade_cache(cache):
+    if not cache.changed:
+        return
+    try:
+        util.write_pickle(cache.fpath, cache.entries)
+    except OSError as error:
+        # The results are already written, the next run grades everyone again
+        print('Could not save the grade cache in {}: {}'.format(cache.fpath, error),
+              file=sys.stderr)
+        return
+    cache.changed = False
@@ -0,0 +1,101 @@
+import json
+
+# Reads a JSON document piece by piece so that a large array can be
+# handled one element at a time without holding the whole file in memory.
+
+CHUNK_SIZE = 1 << 16
+WHITESPACE = ' \t\n\r'
+DELIMITERS = WHITESPACE + ',]}'
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class JsonStream:
+
+    def __init__(self, fp, chunk_size=CHUNK_SIZE):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.position = 0
+        self.decoder = json.JSONDecoder()
+
+    def fill(self):
+        # Read at least as much as is already buffered, so that a value
+        # spanning many chunks is decoded a logarithmic number of times.
+        remaining = self.buffer[self.position:]
+        chunk = self.fp.read(max(self.chunk_size, len(remaining)))
+        self.buffer = remaining + chunk
+        self.position = 0
+        return bool(chunk)
+
+    def peek(self):
+        # Returns the next non whitespace character, or '' at the end
+        while True:
+            while self.position < len(self.buffer) and \
+                    self.buffer[self.position] in WHITESPACE:
+                self.position += 1
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self.fill():
+                return ''
+
+    def expect(self, chars):
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError('Expected one of "{}" but found "{}"'.format(chars, char))
+        self.position += 1
+        return char
+
+    def read_value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+            # A number is only complete once something other than a digit
+            # follows it, 12.|25 would otherwise be read as 12
+            if is_number(value) and not self.delimited(end) and self.fill():
+                continue
+            self.position = end
+            return value
+
+    def delimited(self, end):
+        return end < len(self.buffer) and self.buffer[end] in DELIMITERS
+
+    def iterate_array(self):
+        self.expect('[')
+        if self.peek() == ']':
+            self.position += 1
+            return
+        while True:
+            yield self.read_value()
+            if self.expect(',]') == ']':
+                return
+
+    def iterate_object(self):
+        # Yields the keys of an object. The value of a key has to be read
+        # with read_value or iterate_array before asking for the next key.
+        self.expect('{')
+        if self.peek() == '}':
+            self.position += 1
+            return
+        while True:
+            key = self.read_value()
+            self.expect(':')
+            yield key
+            if self.expect(',}') == '}':
+                return
+
+
+def skip_value(stream):
+    # Arrays are skipped element by element to not decode them all at once
+    if stream.peek() == '[':
+        for _ in stream.iterate_array():
+            pass
+    else:
+        stream.read_value()
@@ -0,0 +1,45 @@
+import lxml.html
+
+# Reads the rows of the table-submissions table on the kattis profile
+# pages. Only the table is walked, with XPath, instead of building a soup
+# for the whole page.
+
+SUBMISSIONS_TABLE = ('//table[contains(concat(" ", normalize-space(@class), " "),'
+                     ' " table-submissions ")]')
+
+
+class PageError(ValueError):
+    pass
+
+
+def cell_text(cell):
+    return cell.text_content()
+
+
+def row_to_dict(row):
+    data_items = row.findall('td')
+    # This is how the html is divided in the table cells.
+    # Submission ID | Time | Name + link to problem | Status | runtime | language
+    #      0        |   1  |          2             |   3    |   4     |   5
+    link = data_items[2].find('.//a')
+    return {
+        'submission_id': cell_text(data_items[0]).strip(),
+        'problem_id': link.get('href').split('/')[-1],
+        'problem_name': cell_text(link),
+        'status': data_items[3].get('class', '').split(),
+        'time': cell_text(data_items[1])
+    }
+
+
+def parse_submission_rows(html):
+    """Returns the rows of the submissions table as dicts with the
+    submission_id, problem_id, problem_name, status (the classes of the
+    status cell) and time of each submission."""
+    document = lxml.html.fromstring(html)
+    tables = document.xpath(SUBMISSIONS_TABLE)
+    if not tables:
+        raise PageError('The page does not have a table of submissions')
+    bodies = tables[0].findall('tbody')
+    if not bodies:
+        raise PageError('The table of submissions does not have a body')
+    return [row_to_dict(row) for row in bodies[0].findall('tr')]
@@ -0,0 +1,187 @@
+import json
+import os
+import threading
+import time
+import util
+
+# One pooled session for all the requests of scrape.py and submit.py. The
+# login cookies are kept in a file that only the user can read, so that
+# later runs skip the login until the cookies expire. A request that is
+# answered with 403 logs in again and is sent once more.
+
+# Cookies without an expiry date are reused for this many seconds
+COOKIE_MAX_AGE = 12 * 60 * 60
+
+# Status codes that mean the login is no longer valid
+LOGIN_STATUS_CODES = {403}
+
+
+##########################################
+# Session                                #
+##########################################
+
+
+def make_session(headers, pool_size=10):
+    # Connections are kept alive and reused instead of being set up again
+    # for each request. The network libraries are only imported by the
+    # code that needs them, so --help and configuration errors are
+    # answered quickly.
+    import requests
+    import requests.adapters
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update(headers)
+    return session
+
+
+class KattisSession:
+    """A requests session that logs in when it has to. login(session)
+    posts the credentials and returns the response, the cookies are kept
+    under key in the cookie cache at cache_path (None to not keep them)."""
+
+    def __init__(self, session, login, key, cache_path=None):
+        self.session = session
+        self.login = login
+        self.key = key
+        self.cache_path = cache_path
+        # Bumped on every login, so that requests that all failed with the
+        # same cookies only log in once
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    def get(self, url, **kwargs):
+        return session_request(self, 'GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return session_request(self, 'POST', url, **kwargs)
+
+
+def make_kattis_session(session, login, key, cache_path=None):
+    return KattisSession(session, login, key, cache_path)
+
+
+def session_key(username, loginurl):
+    return '{}@{}'.format(username, loginurl)
+
+
+def session_relogin(kattis_session, generation):
+    # Returns the login response, or None if another request already
+    # logged in again since generation
+    with kattis_session.lock:
+        if kattis_session.generation != generation:
+            return None
+        kattis_session.session.cookies.clear()
+        response = kattis_session.login(kattis_session.session)
+        kattis_session.generation += 1
+        util.cond([
+            (lambda: response.status_code == 200 and kattis_session.cache_path,
+             lambda: store_cookies(kattis_session.cache_path, kattis_session.key,
+                                   kattis_session.session.cookies))
+        ])()
+        return response
+
+
+def session_login(kattis_session):
+    """Sets up the session with the cached cookies if they are still valid,
+    and logs in otherwise. Returns the login response, or None when the
+    cached cookies are used."""
+    cookies = None if kattis_session.cache_path is None else \
+        load_cookies(kattis_session.cache_path, kattis_session.key)
+    if cookies:
+        util.map_now(lambda cookie: kattis_session.session.cookies.set(**cookie), cookies)
+        return None
+    return session_relogin(kattis_session, kattis_session.generation)
+
+
+def session_request(kattis_session, method, url, **kwargs):
+    generation = kattis_session.generation
+    response = kattis_session.session.request(method, url, **kwargs)
+    if response.status_code not in LOGIN_STATUS_CODES:
+        return response
+    login_response = session_relogin(kattis_session, generation)
+    if login_response is not None and login_response.status_code != 200:
+        return response
+    return kattis_session.session.request(method, url, **kwargs)
+
+
+##########################################
+# Cookie cache                           #
+##########################################
+
+
+def cookie_cache_path(directory=None):
+    return os.path.join(directory or util.default_cache_directory(), 'cookies.json')
+
+
+def cookie_to_dict(cookie, saved):
+    expires = cookie.expires if cookie.expires is not None else saved + COOKIE_MAX_AGE
+    return {
+        'name': cookie.name,
+        'value': cookie.value,
+        'domain': cookie.domain,
+        'path': cookie.path,
+        'secure': cookie.secure,
+        'expires': expires,
+    }
+
+
+def is_fresh(cookie, now):
+    return cookie['expires'] > now
+
+
+class CookieLock:
+    # Holds an exclusive lock on the cookie cache while it is open, where
+    # the platform has flock. The file itself is replaced on every write,
+    # so the lock is taken on a file next to it.
+
+    def __init__(self, fpath):
+        self.fpath = fpath + '.lock'
+        self.fd = None
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.fpath), mode=0o700, exist_ok=True)
+        self.fd = os.open(self.fpath, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            import fcntl
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+        except ImportError:
+            pass
+        return self
+
+    def __exit__(self, *args):
+        # Closing the file releases the lock
+        os.close(self.fd)
+
+
+def read_cookie_cache(fpath):
+    try:
+        with open(fpath, 'r') as f:
+            content = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return content if isinstance(content, dict) else {}
+
+
+def write_cookie_cache(fpath, content):
+    util.atomic_write(fpath, lambda f: json.dump(content, f), permissions=0o600)
+
+
+def load_cookies(fpath, key):
+    """Returns the cookies stored for key, or None if there are none or
+    any of them has expired."""
+    with CookieLock(fpath):
+        cookies = read_cookie_cache(fpath).get(key)
+    now = time.time()
+    if not cookies or not all(is_fresh(cookie, now) for cookie in cookies):
+        return None
+    return cookies
+
+
+def store_cookies(fpath, key, cookie_jar):
+    saved = time.time()
+    with CookieLock(fpath):
+        content = read_cookie_cache(fpath)
+        content[key] = [cookie_to_dict(cookie, saved) for cookie in cookie_jar]
+        write_cookie_cache(fpath, content)
@@ -19,31 +19,44 @@ spawned this idea.
 
 """
 import aaps
+import gradecache
+import report
 import resolver
+import rulecache
 import rules
 import util
 
 import argparse
 import collections
-import colored
+import itertools
+import sys
 
-def as_color(string, color):
+def is_terminal(stream):
+    # Colours are only worth the escape codes when writing to a terminal
+    isatty = getattr(stream, 'isatty', None)
+    return isatty is not None and isatty()
+
+
+def as_color(string, color, use_color=True):
+    if not use_color:
+        return str(string)
+    import colored
     return '{}{}{}'.format(colored.fg(color), string, colored.attr('reset'))
 
-as_red = lambda string: as_color(string, 'red')
-as_green = lambda string: as_color(string, 'green')
-as_pink = lambda string: as_color(string, 'hot_pink_3a')
-as_blue = lambda string: as_color(string, 'blue')
-as_purple = lambda string: as_color(string, 'purple_1b')
+
+Colors = collections.namedtuple('Colors', 'red green pink blue purple')
+
+
+def make_colors(use_color):
+    colorer = lambda color: lambda string: as_color(string, color, use_color)
+    return Colors(*map(colorer, ['red', 'green', 'hot_pink_3a', 'blue', 'purple_1b']))
+
 
 verbose_print = False
 
 Cross = '✗'
 Check = '✓'
 
-cross = as_red(Cross)
-check = as_green(Check)
-
 StudentResult = collections.namedtuple('StudentResult', 'student ruleset kattis context result')
 
 
@@ -51,76 +64,57 @@ def make_student_result(student, ruleset, kattis, context, result):
     return StudentResult(student, ruleset, kattis, context, result)
 
 
-def print_student_result(student_result, detailed):
+def print_student_result(student_result, detailed, stream=None, use_color=None):
     student, ruleset, kattis, context, result = student_result
-    print()
-    print()
-    print(student.name)
-    print('-' * 42)
-    print()
-
-    def get_problem_id(problem):
-        return util.crossroad(lambda: isinstance(problem, str),
-                              lambda: problem,
-                              lambda: problem['id'])
-
-    def get_problem_points(problem):
-        return util.crossroad(lambda: isinstance(problem, str),
-                              lambda: 1,
-                              lambda: problem['points'])
-
-    def get_status_row(problem_id, points, deadline):
-        no_subs = len(kattis.attempts_for(problem_id)) == 0
-        if no_subs:
+    stream = stream or sys.stdout
+    as_red, as_green, as_pink, as_blue, as_purple = make_colors(
+        is_terminal(stream) if use_color is None else use_color)
+    # Lines are collected and written at once for each student
+    lines = []
+    emit = lines.append
+    emit('')
+    emit('')
+    emit(student.name)
+    emit('-' * 42)
+    emit('')
+
+    check = as_green(Check)
+    cross = as_red(Cross)
+
+    def get_status_row(status):
+        if not status['attempted']:
             return '[ - ]'
-        AC = len(kattis.solutions_for(problem_id)) > 0
-        WA_3 = len(kattis.WA_for(problem_id)) >= 3
-        before_deadline = kattis.solved_before(problem_id, deadline)
-        C = lambda b: util.cond([(lambda: b, lambda: check), (lambda: not b, lambda: cross)])()
-
-        if not AC:
-            points = 0
-        if not before_deadline:
-            points /= 2.0
+        C = lambda b: check if b else cross
+        points = status['points']
 
         pts = as_green(points) if points > 0 else as_red(int(points))
         a = '{:16}'.format(pts)
-        b = '{}'.format(C(AC))
-        c = '{}'.format(C(WA_3))
-        d = '{}'.format(C(before_deadline))
+        b = '{}'.format(C(status['AC']))
+        c = '{}'.format(C(status['WA3']))
+        d = '{}'.format(C(status['before_deadline']))
 
         message = '[ Pts? {}  AC? {}  +3WA? {}  Before Deadline? {} ]'
         return message.format(a, b, c, d)
 
-    def print_problem_detail(idx, problem, deadline):
+    def print_problem_detail(idx, status):
         indent = '   '
         if idx % 4 == 0 and idx > 0:
-            print('{}  {}'.format(indent, as_pink('---')))
+            emit('{}  {}'.format(indent, as_pink('---')))
 
-        problem_id = get_problem_id(problem)
-        points = get_problem_points(problem)
-        status_row = get_status_row(problem_id, points, deadline)
-        print('{} {:46} {}'.format(indent, as_blue(problem_id) + ':', status_row))
+        status_row = get_status_row(status)
+        emit('{} {:46} {}'.format(indent, as_blue(status['problem']) + ':', status_row))
 
     def print_uppgift_details(rule):
-        problems = rule.points['uppgift']['problems']
-        if 'deadline' in rule.points['uppgift']:
-            deadline = rule.points['uppgift']['deadline']
-        else:
-            deadline = '01-01-2117 08:00'
-        print_detail = lambda idx, problem: print_problem_detail(idx, problem, deadline)
-        util.starmap_now(print_detail, enumerate(problems))
-
-    def is_uppgift(rule):
-        return isinstance(rule.points, dict) and 'uppgift' in rule.points
+        statuses = report.uppgift_statuses(kattis, rule)
+        util.starmap_now(print_problem_detail, enumerate(statuses))
 
     def print_rule_resolution(rule, points):
         if verbose_print:
             indent = '   '
             rule_name = as_purple(rule.name or 'Unnamed Rule')
-            print('{}Rule: "{}" gave {} pts'.format(indent, rule_name, as_green(points)))
+            emit('{}Rule: "{}" gave {} pts'.format(indent, rule_name, as_green(points)))
             util.cond([
-                (is_uppgift, print_uppgift_details)
+                (report.is_uppgift, print_uppgift_details)
             ])(rule)
 
     def print_goal_resolutions(goal):
@@ -128,13 +122,10 @@ def print_student_result(student_result, detailed):
 
     def print_goal(idx, goal, detailed):
         if idx % 4 == 0 and idx > 0:
-            print('   {}'.format(as_pink('---')))
+            emit('   {}'.format(as_pink('---')))
         name = '{:50}'.format(as_purple(goal.name))
-        p = goal.points
-        if int(p) == goal.points:
-            p = int(p)
-        points = '{:3}'.format(as_green(p))
-        print(name, points)
+        points = '{:3}'.format(as_green(report.as_number(goal.points)))
+        emit('{} {}'.format(name, points))
         if detailed:
             print_goal_resolutions(goal)
     
@@ -148,12 +139,12 @@ def print_student_result(student_result, detailed):
     group_goals = util.filter_now(is_group, result.goals)
 
     def print_goals(name, goals, detailed):
-        print('Goals for {}'.format(as_red(name)))
-        print(' {}'.format(as_pink('-------')))
+        emit('Goals for {}'.format(as_red(name)))
+        emit(' {}'.format(as_pink('-------')))
         print_g = lambda idx, goal: print_goal(idx, goal, detailed)
         util.starmap_now(print_g, enumerate(goals))
-        print(' {}'.format(as_pink('-------')))
-        print()
+        emit(' {}'.format(as_pink('-------')))
+        emit('')
 
     all_goals = [
         ('Individual Sessions',	individual_goals,	False),
@@ -162,45 +153,258 @@ def print_student_result(student_result, detailed):
         ('LAB1',				lab1_goals,			True)
     ]
     util.starmap_now(print_goals, all_goals)
+    stream.write('\n'.join(lines) + '\n')
+
+
+# Number of students that are graded together as one cohort
+COHORT_SIZE = 256
+
+
+def make_student_context(kattis, extra_plugins=()):
+    context = resolver.make_context()
+    plugins = kattis.get_plugins() + list(extra_plugins)
+    add_plugin = lambda c, r: resolver.context_add_plugin(context, c, r)
+    util.starmap_now(add_plugin, plugins)
+    return context
+
+
+def compile_ruleset(ruleset):
+    # All students get their context set up the same way, so an empty
+    # one works as the prototype for compilation.
+    return resolver.compile_ruleset(ruleset, make_student_context(aaps.KattisResult()))
+
+
+def make_student_kattis(student, is_student):
+    kattis = aaps.KattisResult()
+    if is_student:
+        kattis.resolve_sessions_with_input()
+    kattis.add_submission_list(student.submissions)
+    return kattis
+
+
+def resolve_student(student, kattis, ruleset, program, cache=None, extra_plugins=()):
+    context = make_student_context(kattis, extra_plugins)
+    cached = None if cache is None else gradecache.grade_cache_get(cache, student)
+    result = util.crossroad(lambda: cached is not None,
+                            lambda: cached,
+                            lambda: resolver.resolve(ruleset, context, program))
+    return make_student_result(student, ruleset, kattis, context, result)
+
+
+def grade_student(student, ruleset, program, is_student, cache=None):
+    kattis = make_student_kattis(student, is_student)
+    return resolve_student(student, kattis, ruleset, program, cache)
+
+
+def grade_cohort(students, ruleset, program, cache=None):
+    # The uppgift and late expressions are evaluated for all the students
+    # at once, the rest of the rules are resolved one student at a time.
+    # The students are yielded as they are resolved, so only one of them
+    # holds a context and a result at a time.
+    kattis_results = util.map_now(lambda student: make_student_kattis(student, False), students)
+    cohort = aaps.make_cohort(kattis_results)
+    def grade(index, student):
+        plugins = aaps.cohort_plugins(cohort, index)
+        return resolve_student(student, kattis_results[index], ruleset, program, cache, plugins)
+    return itertools.starmap(grade, enumerate(students))
+
+
+def grade_students_in_cohorts(students, ruleset, program, cache=None, size=COHORT_SIZE):
+    students = iter(students)
+    for cohort in iter(lambda: util.take(size, students), []):
+        yield from grade_cohort(cohort, ruleset, program, cache)
+
+
+def parse_rules(rulepath):
+    parsed = {}
+    ruleset = rules.parse_file(rulepath, parsed)
+    return ruleset, list(parsed)
 
-    def get_id(goal):
-        return goal.id
 
-    def is_rest(goal):
-        return goal.id not in map(get_id, upg1_goals) and \
-            goal.id not in map(get_id, lab1_goals) and \
-            goal.id not in map(get_id, individual_goals) and \
-            goal.id not in map(get_id, group_goals)
+def load_rules(rulepath, use_cache, cache_directory):
+    # Returns the ruleset and the paths of its files. With the cache the
+    # ruleset is read from an artifact when the files have not changed.
+    return util.crossroad(lambda: use_cache,
+                          lambda: rulecache.load_ruleset(rulepath, cache_directory),
+                          lambda: parse_rules(rulepath))
 
-    rest_goals = util.filter_now(is_rest, result.goals)
-    #print_goals('Internal', rest_goals)
 
-def main(rulepath, datapath, detailed=False, name_filter=None, is_student=False):
-    ruleset = rules.parse_file(rulepath)
-    exported = aaps.read_exported_kattis_file(datapath)
+def open_grade_cache(rulepath, ruleset, cache_directory, rule_files=None):
+    # Cached results are only valid for the same rules and the same code
+    # for the resolver and the plugins.
+    fingerprint = gradecache.ruleset_fingerprint(rulepath, [aaps, resolver, rules], rule_files)
+    directory = cache_directory or util.default_cache_directory()
+    return gradecache.load_grade_cache(gradecache.grade_cache_path(directory, fingerprint),
+                                       ruleset)
 
-    def handle_student(student):
-        kattis = aaps.KattisResult()
-        if is_student:
-            kattis.resolve_sessions_with_input()
-        add_sub = lambda sub: kattis.add_submission(sub)
-        util.map_now(add_sub, student.submissions)
-        context = resolver.make_context()
-        plugins = kattis.get_plugins()
-        add_plugin = lambda c, r: resolver.context_add_plugin(context, c, r)
-        util.starmap_now(add_plugin, plugins)
-        result = resolver.resolve(ruleset, context)
-        return make_student_result(student, ruleset, kattis, context, result)
 
-    def name_match(student):
-        return name_filter.lower() in student.name or \
-            name_filter.lower() in student.username
+##########################################
+# Parallel grading                       #
+##########################################
 
-    students = util.filter_now(name_match, exported.students)
-    student_results = util.map_now(handle_student, students)
+# Each worker process compiles the ruleset once when it starts. Programs
+# bind nodes by their id, so they can not be sent between processes.
+# Neither can the rules of a result, the worker has its own copy of the
+# ruleset, so goals are sent back with their rules as indices.
+worker_grading = None
 
-    print_result = lambda result: print_student_result(result, detailed)
-    util.map_now(print_result, student_results)
+
+def init_grading_worker(ruleset, interpret, cache_path):
+    global worker_grading
+    program = None if interpret else compile_ruleset(ruleset)
+    # Workers only read from the cache, new results are stored by the parent
+    cache = None if cache_path is None else gradecache.load_grade_cache(cache_path, ruleset)
+    rule_indices = gradecache.make_rule_indices(ruleset.rules)
+    worker_grading = (ruleset, program, cache, rule_indices)
+
+
+def grade_student_in_worker(student):
+    ruleset, program, cache, rule_indices = worker_grading
+    student_result = grade_student(student, ruleset, program, False, cache)
+    # The context holds the plugin closures which can not be pickled, it
+    # is not needed for printing. The parent has the ruleset already.
+    goals = gradecache.encode_goals(rule_indices, student_result.result)
+    return student_result._replace(ruleset=None, context=None, result=None), goals
+
+
+def grade_students_in_parallel(students, ruleset, interpret, jobs, chunksize=16,
+                               cache_path=None):
+    # Results are yielded in the order of the students as they are done
+    import multiprocessing
+    initargs = (ruleset, interpret, cache_path)
+    def with_rules(student_result, goals):
+        return student_result._replace(ruleset=ruleset,
+                                       result=gradecache.decode_goals(ruleset.rules, goals))
+    with multiprocessing.Pool(jobs, init_grading_worker, initargs) as pool:
+        yield from itertools.starmap(with_rules,
+                                     pool.imap(grade_student_in_worker, students, chunksize))
+
+
+def print_totals(totals, stream=None):
+    content = report.totals_to_dict(totals)
+    lines = ['', '', 'Totals for {} students'.format(content['students']), '-' * 42, '']
+    lines.append('{:50} {:>6} {:>6} {:>6}'.format('Goal', 'Mean', 'Min', 'Max'))
+    lines.extend('{:50} {:>6} {:>6} {:>6}'.format(goal['name'], goal['mean'], goal['min'],
+                                                  goal['max'])
+                 for goal in content['goals'])
+    (stream or sys.stdout).write('\n'.join(lines) + '\n')
+
+
+def make_text_writer(stream, detailed, totals=None):
+    use_color = is_terminal(stream)
+    def write(student_result):
+        report.totals_add(totals, student_result)
+        print_student_result(student_result, detailed, stream, use_color)
+
+    def finish():
+        util.cond([
+            (lambda: totals is not None, lambda: print_totals(totals, stream))
+        ])()
+        stream.flush()
+
+    return report.Writer(write, finish)
+
+
+##########################################
+# Profiling                              #
+##########################################
+
+PROFILE_FORMATS = ['table', 'json']
+
+
+def profile_phase(label, func, *args):
+    return util.crossroad(
+        lambda: resolver.active_profile is None,
+        lambda: func(*args),
+        lambda: resolver.profile_call(resolver.active_profile.phases, label, func, *args))
+
+
+def print_profile(profile, fmt, stream=None):
+    stream = stream or sys.stderr
+    content = resolver.profile_to_dict(profile)
+    if fmt == 'json':
+        import json
+        stream.write(json.dumps(content, indent=2) + '\n')
+        return
+    lines = []
+    for title, entries in content.items():
+        lines.extend(['', '{:60} {:>9} {:>10}'.format(title.capitalize(), 'Calls', 'Seconds')])
+        lines.extend('{:60} {:>9} {:>10.4f}'.format(entry['name'], entry['calls'],
+                                                    entry['seconds'])
+                     for entry in entries)
+    stream.write('\n'.join(lines) + '\n')
+
+
+def make_output_writer(fmt, stream, detailed, totals=None):
+    return util.crossroad(lambda: fmt == 'text',
+                          lambda: make_text_writer(stream, detailed, totals),
+                          lambda: report.make_writer(fmt, stream, detailed, totals))
+
+
+def main(rulepath, datapath, detailed=False, name_filter=None, is_student=False,
+         interpret=False, jobs=1, use_cache=True, cache_directory=None, fmt='text',
+         stream=None, with_totals=False, profile=None):
+    # With a profile every student is resolved in this process and nothing
+    # is read from the caches, so that all of the work is measured
+    util.cond([
+        (lambda: profile is not None, lambda: resolver.start_profile())
+    ])()
+    use_cache = use_cache and profile is None
+    ruleset, rule_files = profile_phase('load_rules', load_rules, rulepath, use_cache,
+                                        cache_directory)
+    # Students answer questions about their sessions, so they are never cached
+    cache = util.crossroad(lambda: use_cache and not is_student,
+                           lambda: open_grade_cache(rulepath, ruleset, cache_directory, rule_files),
+                           util.constant(None))
+    cache_path = None if cache is None else cache.fpath
+
+    def grade_students(students):
+        program = None if interpret else profile_phase('compile_ruleset', compile_ruleset,
+                                                       ruleset)
+        handle_student = lambda student: grade_student(student, ruleset, program,
+                                                       is_student, cache)
+        # Students answer their session questions one at a time
+        return util.crossroad(lambda: is_student,
+                              lambda: map(handle_student, students),
+                              lambda: grade_students_in_cohorts(students, ruleset, program,
+                                                                cache))
+
+    def remember(student_result):
+        util.cond([
+            (lambda: cache is not None,
+             lambda: gradecache.grade_cache_put(cache, student_result.student,
+                                                student_result.result))
+        ])()
+        return student_result
+
+    def name_match(username, name):
+        return name_filter.lower() in name or \
+            name_filter.lower() in username
+
+    # Students are asked about their sessions, that only works in one process
+    in_parallel = lambda: jobs > 1 and not is_student and profile is None
+    # Students are read one at a time and printed as soon as they are graded
+    students = aaps.iterate_exported_kattis_file(datapath, name_match)
+    student_results = util.crossroad(
+        in_parallel,
+        lambda: grade_students_in_parallel(students, ruleset, interpret, jobs,
+                                           cache_path=cache_path),
+        lambda: grade_students(students))
+
+    # Each student is written and let go of before the next is graded,
+    # only the running totals are kept for the footer.
+    totals = report.make_totals() if with_totals else None
+    writer = make_output_writer(fmt, stream or sys.stdout, detailed, totals)
+    for student_result in student_results:
+        writer.write(remember(student_result))
+    writer.finish()
+    util.cond([
+        (lambda: cache is not None, lambda: gradecache.save_grade_cache(cache))
+    ])()
+    util.cond([
+        (lambda: profile is not None,
+         lambda: print_profile(resolver.stop_profile(), profile))
+    ])()
 
 
 if __name__ == '__main__':
@@ -211,9 +415,22 @@ if __name__ == '__main__':
 
     add_flag('--student', 'For viewing only your own results')
     add_flag('--detailed', 'For viewing detailed results')
+    add_flag('--interpret', 'Interpret the rules instead of compiling them')
+    add_flag('--no-cache', 'Grade every student again instead of using cached results')
+    add_flag('--totals', 'End with the mean, min and max points of every goal')
     parser.add_argument('--data', help='Data to read from')
     parser.add_argument('--rules', help='Rules to use for judging')
     parser.add_argument('--filter', default='', help='Filter on name')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='Number of processes to grade students with')
+    parser.add_argument('--cache-dir', help='Where to keep cached results')
+    parser.add_argument('--format', choices=report.FORMATS, default='text',
+                        help='Write the results as coloured text, JSON or CSV')
+    parser.add_argument('--profile', nargs='?', const='table', choices=PROFILE_FORMATS,
+                        help='Time every handler keyword and rule, written to stderr '
+                        'as a table or JSON. Grades in one process without the caches')
     args = parser.parse_args()
     main(args.rules, args.data, detailed=args.detailed, name_filter=args.filter,
-         is_student=args.student)
+         is_student=args.student, interpret=args.interpret, jobs=args.jobs,
+         use_cache=not args.no_cache, cache_directory=args.cache_dir, fmt=args.format,
+         with_totals=args.totals, profile=args.profile)
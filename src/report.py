@@ -0,0 +1,232 @@
+import aaps
+import collections
+import json
+import util
+
+# Graded students as plain data, written as JSON or CSV for the grading
+# spreadsheet instead of the coloured text of main.py.
+
+FORMATS = ['text', 'json', 'csv']
+
+CSV_COLUMNS = ['username', 'name', 'goal', 'rule', 'problem', 'points',
+               'attempted', 'AC', 'WA3', 'before_deadline']
+
+
+##########################################
+# Problems                               #
+##########################################
+
+
+def is_uppgift(rule):
+    return isinstance(rule.points, dict) and 'uppgift' in rule.points
+
+
+def uppgift_deadline(rule):
+    return rule.points['uppgift'].get('deadline', aaps.NO_DEADLINE)
+
+
+def problem_status(kattis, problem, deadline):
+    problem_id, problem_points = aaps.make_problem(problem)
+    AC = kattis.has_solved(problem_id)
+    before_deadline = kattis.solved_before(problem_id, deadline)
+    points = problem_points if AC else 0
+    if not before_deadline:
+        points /= 2.0
+    return collections.OrderedDict([
+        ('problem', problem_id),
+        ('points', points),
+        ('attempted', kattis.has_attempted(problem_id)),
+        ('AC', AC),
+        ('WA3', kattis.WA_count_for(problem_id) >= 3),
+        ('before_deadline', before_deadline),
+    ])
+
+
+def uppgift_statuses(kattis, rule):
+    deadline = uppgift_deadline(rule)
+    status = lambda problem: problem_status(kattis, problem, deadline)
+    return util.map_now(status, rule.points['uppgift']['problems'])
+
+
+##########################################
+# Students                               #
+##########################################
+
+
+def as_number(points):
+    return int(points) if int(points) == points else points
+
+
+def rule_to_dict(kattis, rule, points):
+    problems = util.crossroad(lambda: is_uppgift(rule),
+                              lambda: uppgift_statuses(kattis, rule),
+                              lambda: [])
+    for status in problems:
+        status['points'] = as_number(status['points'])
+    return collections.OrderedDict([
+        ('name', rule.name),
+        ('points', as_number(points)),
+        ('problems', problems),
+    ])
+
+
+def goal_to_dict(kattis, goal, detailed):
+    content = collections.OrderedDict([
+        ('id', goal.id),
+        ('points', as_number(goal.points)),
+    ])
+    if detailed:
+        to_dict = lambda rule, points: rule_to_dict(kattis, rule, points)
+        content['rules'] = util.starmap_now(to_dict, goal.resolved_rules)
+    return content
+
+
+def student_result_to_dict(student_result, detailed=False):
+    """Returns the goals of a graded student as plain data. With detailed
+    the rules that gave points to each goal are included, together with
+    the status of every problem of the uppgift rules."""
+    student, kattis, result = student_result.student, student_result.kattis, student_result.result
+    to_dict = lambda goal: goal_to_dict(kattis, goal, detailed)
+    return collections.OrderedDict([
+        ('username', student.username),
+        ('name', student.name),
+        ('goals', util.map_now(to_dict, result.goals)),
+    ])
+
+
+def student_to_rows(content):
+    student = [content['username'], content['name']]
+    rows = []
+    for goal in content['goals']:
+        rows.append(student + [goal['id'], '', '', goal['points'], '', '', '', ''])
+        for rule in goal.get('rules', []):
+            rows.append(student + [goal['id'], rule['name'], '', rule['points'], '', '', '', ''])
+            rows.extend(student + [goal['id'], rule['name']] + list(status.values())
+                        for status in rule['problems'])
+    return rows
+
+
+##########################################
+# Totals                                 #
+##########################################
+
+# Course-wide totals are kept as running aggregates, so the students can
+# be written and let go of one at a time.
+
+
+class Totals:
+
+    def __init__(self):
+        self.students = 0
+        # goal id -> [name, students, sum, min, max], in the order first seen
+        self.goals = collections.OrderedDict()
+
+
+def make_totals():
+    return Totals()
+
+
+def totals_add_goal(totals, goal):
+    entry = totals.goals.get(goal.id)
+    if entry is None:
+        totals.goals[goal.id] = [goal.name, 1, goal.points, goal.points, goal.points]
+        return
+    entry[1] += 1
+    entry[2] += goal.points
+    entry[3] = min(entry[3], goal.points)
+    entry[4] = max(entry[4], goal.points)
+
+
+def totals_add(totals, student_result):
+    if totals is None:
+        return
+    totals.students += 1
+    util.map_now(lambda goal: totals_add_goal(totals, goal), student_result.result.goals)
+
+
+def goal_totals_to_dict(goal_id, entry):
+    name, students, total, low, high = entry
+    return collections.OrderedDict([
+        ('id', goal_id),
+        ('name', name),
+        ('students', students),
+        ('mean', as_number(round(total / students, 2))),
+        ('min', as_number(low)),
+        ('max', as_number(high)),
+    ])
+
+
+def totals_to_dict(totals):
+    return collections.OrderedDict([
+        ('students', totals.students),
+        ('goals', util.starmap_now(goal_totals_to_dict, totals.goals.items())),
+    ])
+
+
+def totals_to_rows(content):
+    rows = []
+    for statistic in ['mean', 'min', 'max']:
+        rows.extend(['', statistic, goal['id'], '', '', goal[statistic], '', '', '', '']
+                    for goal in content['goals'])
+    return rows
+
+
+##########################################
+# Writers                                #
+##########################################
+
+# write takes a graded student, finish is called once after the last one.
+# With totals the writers add every student to them and end with a footer.
+Writer = collections.namedtuple('Writer', 'write finish')
+
+
+def make_json_writer(stream, detailed, totals=None):
+    # The students are written as one array, one student at a time so that
+    # results show up while the rest are graded. With totals the array is
+    # the students of an object that also holds the totals.
+    written = [0]
+    start, end = ('[', ']') if totals is None else ('{"students": [', ']')
+
+    def write(student_result):
+        totals_add(totals, student_result)
+        content = json.dumps(student_result_to_dict(student_result, detailed))
+        stream.write('{}{}'.format(',\n' if written[0] else start + '\n', content))
+        written[0] += 1
+
+    def finish():
+        stream.write('\n' + end if written[0] else start + end)
+        util.cond([
+            (lambda: totals is not None,
+             lambda: stream.write(', "totals": {}}}'.format(json.dumps(totals_to_dict(totals)))))
+        ])()
+        stream.write('\n')
+        stream.flush()
+
+    return Writer(write, finish)
+
+
+def make_csv_writer(stream, detailed, totals=None):
+    import csv
+    writer = csv.writer(stream)
+    writer.writerow(CSV_COLUMNS)
+
+    def write(student_result):
+        totals_add(totals, student_result)
+        writer.writerows(student_to_rows(student_result_to_dict(student_result, detailed)))
+
+    def finish():
+        util.cond([
+            (lambda: totals is not None,
+             lambda: writer.writerows(totals_to_rows(totals_to_dict(totals))))
+        ])()
+        stream.flush()
+
+    return Writer(write, finish)
+
+
+def make_writer(fmt, stream, detailed, totals=None):
+    writers = {
+        'json': make_json_writer,
+        'csv': make_csv_writer,
+    }
+    return writers[fmt](stream, detailed, totals)
@@ -1,23 +1,54 @@
-import copy
 import collections
 import util
 import functools
+import itertools
 import operator
+import time
 
 
 ##########################################
 # Context                                #
 ##########################################
 
+Handler = collections.namedtuple('Handler', 'priority checker resolver')
+
+
 class Context:
 
     def __init__(self):
+        # Handlers that know their keyword (or literal type) are looked up
+        # directly, the function handlers are checkers that can only say
+        # whether they handle a tree or not and have to be asked in order.
+        self.keyword_handlers = {}
+        self.type_handlers = {}
         self.function_handlers = collections.deque()
+        self.plugin_priority = 0
+        self.builtin_priority = 0
         self.result = None
+        self.dispatch = {}
+        # Expressions that occur more than once in the ruleset, by their
+        # shape, and the values computed for those shapes so far
+        self.shapes = {}
+        self.memo = {}
+        # Set when a handler has side effects, nothing is reused then
+        self.impure = False
+        # Only set on a ProfilingContext
+        self.profile = None
 
     def handle_expression(self, tree):
-        handler = util.cond(self.function_handlers)
-        return handler(self, tree)
+        shape = self.shapes.get(id(tree))
+        if shape is not None and shape in self.memo:
+            return self.memo[shape]
+        # A compiled node gives the key of its handler in this context, see
+        # compile_ruleset, the others are looked up as they are met
+        key = self.dispatch.get(id(tree))
+        if key is None:
+            key = context_handler_key(self, tree)
+        handler = context_handler_for_key(self, key)
+        value = handler(self, tree)
+        if shape is not None:
+            self.memo[shape] = value
+        return value
 
 
     def value_expression(self, tree):
@@ -36,22 +67,121 @@ class Context:
 
 
 def make_context():
-    context = Context()
+    context = util.crossroad(lambda: active_profile is None,
+                             lambda: Context(),
+                             lambda: ProfilingContext(active_profile))
     add_builtin_functions(context)
     return context
 
 
+def context_register(context, handler, add_function_handler):
+    keyword = getattr(handler.checker, 'keyword', None)
+    target_type = getattr(handler.checker, 'target_type', None)
+
+    def add_to(table, key):
+        # Lower priority wins, same as the order the checkers are asked in
+        existing = table.get(key)
+        if existing is None or handler.priority < existing.priority:
+            table[key] = handler
+
+    # A resolver with side effects, such as asking the user, sets impure
+    context.impure = context.impure or getattr(handler.resolver, 'impure', False)
+    util.cond([
+        (lambda: keyword is not None, lambda: add_to(context.keyword_handlers, keyword)),
+        (lambda: target_type is not None, lambda: add_to(context.type_handlers, target_type)),
+        (util.truthy, lambda: add_function_handler(handler))
+    ])()
+
+
 def context_add_handler(context, handler):
-    context.function_handlers.append(handler)
+    checker, resolver = handler
+    priority = context.builtin_priority
+    context.builtin_priority += 1
+    context_register(context, Handler(priority, checker, resolver),
+                     context.function_handlers.append)
 
 
 def context_set_result(context, result):
     context.result = result
+    # Remembered values belong to the result they were computed for
+    context.memo = {}
 
 
 def context_add_plugin(context, checker, resolver):
     # Plugins have priority over built-in functions
-    context.function_handlers.appendleft((checker, resolver))
+    context.plugin_priority -= 1
+    priority = context.plugin_priority
+    context_register(context, Handler(priority, checker, resolver),
+                     context.function_handlers.appendleft)
+
+
+def context_add_keyword_handler(context, keyword, resolver):
+    context_add_handler(context, (make_checker(keyword), resolver))
+
+
+def context_add_keyword_plugin(context, keyword, resolver):
+    context_add_plugin(context, make_checker(keyword), resolver)
+
+
+def context_indexed_candidates(context, tree):
+    def keyword_candidate(keyword):
+        return context.keyword_handlers.get(keyword), ('keyword_handlers', keyword)
+    def type_candidate(target_type):
+        return context.type_handlers.get(target_type), ('type_handlers', target_type)
+
+    candidates = util.crossroad(lambda: isinstance(tree, dict),
+                                lambda: map(keyword_candidate, tree),
+                                lambda: map(type_candidate, type(tree).__mro__))
+    return [(handler.priority, key) for handler, key in candidates if handler is not None]
+
+
+def context_handler_key(context, tree):
+    # The key identifies the handler that would be chosen for tree in any
+    # context that has been set up in the same way as this one. Function
+    # handlers only need to be asked if they have priority over the best
+    # indexed handler.
+    best = min(context_indexed_candidates(context, tree), default=None)
+
+    def has_priority(handler):
+        return best is None or handler.priority < best[0]
+    def is_match(indexed):
+        return indexed[1].checker(context, tree)
+
+    handlers = itertools.takewhile(has_priority, context.function_handlers)
+    found = util.find(is_match, enumerate(handlers))
+    return util.cond([
+        (lambda: found is not None, lambda: ('function_handlers', found[0])),
+        (lambda: best is not None, lambda: best[1]),
+        (util.truthy, util.constant(None))
+    ])()
+
+
+def unhandled_resolver(context, tree):
+    # Nothing handles the tree, it resolves to None like before the
+    # handlers were indexed, so a rule that needs it does not count
+    return None
+
+
+def context_handler_for_key(context, key):
+    # A key is the name of the handler table and the index into it
+    if key is None:
+        return unhandled_resolver
+    table, index = key
+    return getattr(context, table)[index].resolver
+
+
+def context_layout(context):
+    return (len(context.function_handlers),
+            frozenset(context.keyword_handlers),
+            frozenset(context.type_handlers))
+
+
+def context_set_program(context, program):
+    # A program compiled against a differently set up context would bind
+    # nodes to the wrong handlers, so fall back to interpreting instead.
+    matches = program is not None and program.layout == context_layout(context)
+    context.dispatch = program.dispatch if matches else {}
+    context.shapes = program.shapes if matches and not context.impure else {}
 
 ##########################################
 # Builtin functions for context          #
@@ -60,6 +190,7 @@ def context_add_plugin(context, checker, resolver):
 def make_checker(string):
     def checker(context, tree):
         return isinstance(tree, dict) and string in tree
+    checker.keyword = string
     return checker
 
 
@@ -89,7 +220,9 @@ def make_comparison_handler(string, oper):
 
 
 def make_type_handler(target_type):
-    checker = lambda context, tree: isinstance(tree, target_type)
+    def checker(context, tree):
+        return isinstance(tree, target_type)
+    checker.target_type = target_type
     resolver = lambda context, tree: tree
     return (checker, resolver)
 
@@ -176,7 +309,9 @@ def add_builtin_functions(context):
 class Result:
 
     def __init__(self):
+        # The goals in the order they were added, and the same goals by id
         self.goals = []
+        self.goals_by_id = {}
 
 
 def result_get_goals(result):
@@ -185,6 +320,11 @@ def result_get_goals(result):
 
 def result_add_goal(result, goal):
     result.goals.append(goal)
+    result.goals_by_id[goal.id] = goal
+
+
+def result_get_goal(result, goal_id):
+    return result.goals_by_id.get(goal_id)
 
 
 def result_get_or_add_goal(result, rule):
@@ -194,12 +334,8 @@ def result_get_or_add_goal(result, rule):
         result_add_goal(result, goal)
         return goal
 
-    def is_correct_goal(goal):
-        return rule.towards == goal.id
-
     def get_goal():
-        goal = util.find(is_correct_goal, result_get_goals(result))
-        return goal
+        return result_get_goal(result, rule.towards)
 
     return util.crossroad(get_goal, get_goal, on_fail)
 
@@ -216,9 +352,7 @@ def result_update_failed_goal(result, rule):
 
 
 def result_get_goal_points(result, goal_id):
-    def is_correct_goal(goal):
-        return goal.id == goal_id
-    goal = util.find(is_correct_goal, result.goals)
+    goal = result_get_goal(result, goal_id)
     on_fail = lambda: 0
     on_success = lambda: goal.points
     return util.crossroad(lambda: goal, on_success, on_fail)
@@ -277,7 +411,7 @@ def find_expressions(expr, root):
         return isinstance(tree, list)
 
     def add_expression(tree):
-        result.append(copy.deepcopy(tree))
+        result.append(tree)
     def find_in_children(tree):
         return find_expression_rec(list(tree.values()))
     def search_in_list(seq):
@@ -293,33 +427,36 @@ def find_expressions(expr, root):
     find_expression_rec(root)
     return result
 
-def topological_order(rules):
-    # 1. Find each rule and the goals that it depends on
-    # 2. Create a dependency tree where each rule depends
-    #    on all rules that go towards what they depend on
-    # 3. Solve dependency with toposort
-
-    goal_dependencies = collections.defaultdict(set)
-    def find_and_add_goals(index, rule):
+def rule_dependencies(rules):
+    # For each rule, the indices of all rules that go towards a goal that
+    # the rule gets. Note: this includes the rule itself, because we can
+    # have the case that a user writes a rule that depends on itself being
+    # completed...
+    towards_indices = collections.defaultdict(list)
+    def add_towards(index, rule):
+        towards_indices[rule.towards].append(index)
+    util.starmap_now(add_towards, enumerate(rules))
+
+    def find_goals(rule):
         get_need = find_expressions('get', rule.needs)
         get_point = find_expressions('get', rule.points)
-        all_goals = get_need + get_point
-        add_goal = lambda expr: goal_dependencies[index].add(expr['get'])
-        util.map_now(add_goal, all_goals)
+        return set(expr['get'] for expr in get_need + get_point)
 
-    util.starmap_now(find_and_add_goals, enumerate(rules))
+    def find_rule_dependency(rule):
+        indices = (towards_indices.get(goal, []) for goal in find_goals(rule))
+        return sorted(set(itertools.chain.from_iterable(indices)))
 
+    return util.map_now(find_rule_dependency, rules)
 
-    def is_dependency_rule(index, original_idx):
-        return rules[index].towards in goal_dependencies[original_idx]
-    def find_rule_dependency(index):
-        indices = range(len(rules))
-        # Note: also include self, because we can have the case that a user writes
-        # a rule that depends on itself being completed...
-        indexes_to_add = filter(lambda idx: is_dependency_rule(idx, index), indices)
-        return list(indexes_to_add)
 
-    rule_dependency = util.map_now(find_rule_dependency, range(len(rules)))
+def topological_order(rules, rule_dependency=None):
+    # 1. Find each rule and the goals that it depends on
+    # 2. Create a dependency tree where each rule depends
+    #    on all rules that go towards what they depend on
+    # 3. Solve dependency with toposort
+    if rule_dependency is None:
+        rule_dependency = rule_dependencies(rules)
+
     rule_rev_dependency = [[] for _ in range(len(rules))]
     def add_rev_dependency(key, values):
         util.map_now(lambda val: rule_rev_dependency[val].append(key), values)
@@ -351,15 +488,120 @@ def topological_order(rules):
     return queue
 
 
+def ruleset_dependencies(ruleset):
+    cache = ruleset.cache
+    if 'dependencies' not in cache:
+        cache['dependencies'] = rule_dependencies(ruleset.rules)
+    return cache['dependencies']
+
+
+def ruleset_order(ruleset):
+    # The order only depends on the rules, so it is computed once and kept
+    # on the ruleset until a rule is added.
+    cache = ruleset.cache
+    if 'order' not in cache:
+        order = lambda: topological_order(ruleset.rules, ruleset_dependencies(ruleset))
+        cache['order'] = util.crossroad(
+            lambda: active_profile is None,
+            order,
+            lambda: profile_call(active_profile.phases, 'topological_order', order))
+    return cache['order']
+
+
+##########################################
+# Compilation                            #
+##########################################
+
+
+# The dispatch is keyed on node ids, the program keeps the ruleset alive
+# so that those ids stay valid for as long as the program is used.
+# shapes maps the ids of expressions that occur more than once to a number
+# that is the same for structurally equal expressions.
+Program = collections.namedtuple('Program', 'ruleset dispatch layout shapes')
+
+
+def iterate_tree(root):
+    stack = [root]
+    while stack:
+        tree = stack.pop()
+        yield tree
+        if isinstance(tree, dict):
+            stack.extend(tree.values())
+        elif isinstance(tree, list):
+            stack.extend(tree)
+
+
+def shape_nodes(root, structures, node_shapes):
+    # Numbers every node in root by its structure, equal subtrees get the
+    # same number. structures maps each structure seen so far to its
+    # number and node_shapes gets the number of every node by its id.
+    def shape(tree):
+        if isinstance(tree, dict):
+            structure = ('dict', tuple(sorted((key, shape(value)) for key, value in tree.items())))
+        elif isinstance(tree, list):
+            structure = ('list', tuple(map(shape, tree)))
+        else:
+            # The type keeps apart values that compare equal, like 1 and True
+            structure = (type(tree).__name__, tree)
+        number = structures.setdefault(structure, len(structures))
+        node_shapes[id(tree)] = number
+        return number
+    return shape(root)
+
+
+def repeated_shapes(ruleset, dispatch):
+    # Every rule is resolved in topological order, so a goal is complete
+    # before any rule gets it. An expression then has the same value every
+    # time it is resolved for a student, and only expressions that occur
+    # more than once are worth remembering.
+    structures = {}
+    node_shapes = {}
+    def shape_rule(rule):
+        shape_nodes(rule.needs, structures, node_shapes)
+        shape_nodes(rule.points, structures, node_shapes)
+    util.map_now(shape_rule, ruleset.rules)
+
+    expressions = {node: shape for node, shape in node_shapes.items() if node in dispatch}
+    counts = collections.Counter(expressions.values())
+    return {node: shape for node, shape in expressions.items() if counts[shape] > 1}
+
+
+def compile_ruleset(ruleset, context):
+    """Walks every rule once and records for each node which handler the
+    context would pick for it, so that resolving a student does not have
+    to probe every checker for every node.
+
+    Nodes are not bound to the handler functions themselves. The plugins
+    are closures over the submissions of one student, made anew for every
+    student's context, so a program that is compiled once can only hold
+    where the handler is found: the name of its table and its index. The
+    context is only used as a prototype, the program can be used with any
+    context set up the same way."""
+    dispatch = {}
+    def bind(tree):
+        key = context_handler_key(context, tree)
+        util.cond([
+            (lambda: key is not None, lambda: dispatch.__setitem__(id(tree), key))
+        ])()
+    def bind_rule(rule):
+        util.map_now(bind, iterate_tree(rule.needs))
+        util.map_now(bind, iterate_tree(rule.points))
+
+    util.map_now(bind_rule, ruleset.rules)
+    return Program(ruleset, dispatch, context_layout(context), repeated_shapes(ruleset, dispatch))
+
+
 ##########################################
 # Resolver function                      #
 ##########################################
 
 
-def resolve(ruleset, context):
+def resolve(ruleset, context, program=None):
+    # Without a program the rules are interpreted node by node
     rules = ruleset.rules
     result = Result()
     context_set_result(context, result)
+    context_set_program(context, program)
 
     def on_rule_fail(rule):
         result_update_failed_goal(result, rule)
@@ -378,9 +620,107 @@ def resolve(ruleset, context):
         fail = lambda: on_rule_fail(rule)
         util.crossroad(lambda: needs, success, fail)
 
+    process = util.crossroad(
+        lambda: context.profile is None,
+        lambda: process_rule,
+        lambda: lambda rule: profile_call(context.profile.rules, rule_label(rule),
+                                          process_rule, rule))
+
     def process_by_index(index):
-        process_rule(rules[index])
+        process(rules[index])
 
-    order = topological_order(rules)
-    util.map_now(process_by_index, order)
+    util.map_now(process_by_index, ruleset_order(ruleset))
     return result
+
+
+##########################################
+# Profiling                              #
+##########################################
+
+# Profiling is switched on for the whole process with start_profile.
+# Contexts made while it is on time every expression by the keyword (or
+# literal type) of its handler, and resolve times every rule. Contexts
+# made while it is off are the plain ones, so they pay nothing for it.
+
+active_profile = None
+
+
+class Profile:
+
+    def __init__(self):
+        # label -> [calls, cumulative seconds]. Handler times include the
+        # expressions below them, so nested keywords are counted again.
+        # Values reused from the memo are counted in memo, not in handlers.
+        self.handlers = collections.defaultdict(lambda: [0, 0.0])
+        self.memo = collections.defaultdict(lambda: [0, 0.0])
+        self.rules = collections.defaultdict(lambda: [0, 0.0])
+        self.phases = collections.defaultdict(lambda: [0, 0.0])
+
+
+def start_profile():
+    global active_profile
+    active_profile = Profile()
+    return active_profile
+
+
+def stop_profile():
+    global active_profile
+    profile, active_profile = active_profile, None
+    return profile
+
+
+def profile_call(table, label, func, *args):
+    started = time.perf_counter()
+    try:
+        return func(*args)
+    finally:
+        entry = table[label]
+        entry[0] += 1
+        entry[1] += time.perf_counter() - started
+
+
+def handler_label(context, tree):
+    key = context.dispatch.get(id(tree)) or context_handler_key(context, tree)
+    if key is None:
+        return 'unhandled'
+    table, index = key
+    return util.cond([
+        (lambda: table == 'keyword_handlers', lambda: index),
+        (lambda: table == 'type_handlers', lambda: index.__name__),
+        (util.truthy, lambda: getattr(context.function_handlers[index].checker,
+                                      'keyword', 'function'))
+    ])()
+
+
+def rule_label(rule):
+    return '{} -> {}'.format(rule.name or 'Unnamed Rule', rule.towards)
+
+
+class ProfilingContext(Context):
+
+    def __init__(self, profile):
+        super().__init__()
+        self.profile = profile
+
+    def handle_expression(self, tree):
+        shape = self.shapes.get(id(tree))
+        table = util.crossroad(lambda: shape is not None and shape in self.memo,
+                               lambda: self.profile.memo,
+                               lambda: self.profile.handlers)
+        handle = super().handle_expression
+        return profile_call(table, handler_label(self, tree), handle, tree)
+
+
+def profile_to_dict(profile):
+    """Returns the profile as plain data, with the entries of every table
+    sorted by their cumulative time."""
+    def table_to_list(table):
+        entries = sorted(table.items(), key=lambda item: item[1][1], reverse=True)
+        return [collections.OrderedDict([('name', label), ('calls', calls), ('seconds', seconds)])
+                for label, (calls, seconds) in entries]
+    return collections.OrderedDict([
+        ('phases', table_to_list(profile.phases)),
+        ('handlers', table_to_list(profile.handlers)),
+        ('memo', table_to_list(profile.memo)),
+        ('rules', table_to_list(profile.rules)),
+    ])
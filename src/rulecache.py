@@ -0,0 +1,144 @@
+import os
+import resolver
+import rules
+import sys
+import time
+import util
+
+# A parsed ruleset is kept as a pickle together with its order, so that
+# later runs with the same rule files do not parse any JSON. The files
+# are first compared on their modification time and size, and only read
+# and hashed when those have changed.
+
+# Bump when the layout of the artifact changes
+ARTIFACT_VERSION = 1
+
+# The code that builds the ruleset, a change to it invalidates the artifact
+CODE_FILES = [os.path.abspath(rules.__file__), os.path.abspath(resolver.__file__)]
+
+# Set once a write has failed, so the warning is only printed once
+warned_unwritable = False
+
+
+##########################################
+# Files                                  #
+##########################################
+
+
+def file_digest(fpath):
+    import hashlib
+    with open(fpath, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def file_stat(fpath):
+    stat = os.stat(fpath)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def describe_file(fpath):
+    return (fpath,) + file_stat(fpath) + (file_digest(fpath),)
+
+
+def has_same_stat(description):
+    fpath, mtime, size, _ = description
+    try:
+        return file_stat(fpath) == (mtime, size)
+    except OSError:
+        return False
+
+
+def has_same_content(description):
+    try:
+        return file_digest(description[0]) == description[3]
+    except OSError:
+        return False
+
+
+##########################################
+# Artifact                               #
+##########################################
+
+
+def artifact_path(directory, rulepath):
+    import hashlib
+    name = hashlib.sha256(os.path.abspath(rulepath).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(directory, 'rules-{}.pickle'.format(name))
+
+
+def make_artifact(ruleset, fpaths):
+    return {
+        'version': ARTIFACT_VERSION,
+        # (path, modification time, size, digest) of every file
+        'files': util.map_now(describe_file, fpaths),
+        'ruleset': ruleset,
+    }
+
+
+def artifact_rule_files(artifact):
+    return [description[0] for description in artifact['files']
+            if description[0] not in CODE_FILES]
+
+
+def read_artifact(fpath):
+    artifact = util.read_pickle(fpath, {})
+    return artifact if artifact.get('version') == ARTIFACT_VERSION else None
+
+
+def warn_unwritable(fpath, error):
+    global warned_unwritable
+    if not warned_unwritable:
+        print('Could not store the parsed rules in {}: {}'.format(fpath, error), file=sys.stderr)
+    warned_unwritable = True
+
+
+def write_artifact(fpath, artifact, started):
+    # A file modified after the rules were read may not match them, the
+    # artifact is then built again on the next run instead.
+    modified = max(description[1] for description in artifact['files'])
+    if modified >= started:
+        return
+    # Without a usable cache directory the rules are parsed on every run,
+    # same as when the artifact can not be read
+    try:
+        util.write_pickle(fpath, artifact)
+    except OSError as error:
+        warn_unwritable(fpath, error)
+
+
+def build_artifact(fpath, rulepath):
+    started = time.time_ns()
+    parsed = {}
+    ruleset = rules.parse_file(rulepath, parsed)
+    resolver.ruleset_order(ruleset)
+    artifact = make_artifact(ruleset, list(parsed) + CODE_FILES)
+    write_artifact(fpath, artifact, started)
+    return artifact
+
+
+def refresh_artifact(fpath, artifact):
+    # The files were touched but not changed, store their new times so
+    # they do not have to be hashed again
+    started = time.time_ns()
+    fpaths = [description[0] for description in artifact['files']]
+    artifact = make_artifact(artifact['ruleset'], fpaths)
+    write_artifact(fpath, artifact, started)
+    return artifact
+
+
+def load_ruleset(rulepath, directory=None):
+    """Returns the ruleset of rulepath, with its order computed, and the
+    paths of its rule files. The ruleset is read from the artifact in
+    directory when none of the files have changed."""
+    fpath = artifact_path(directory or util.default_cache_directory(), rulepath)
+    artifact = read_artifact(fpath)
+    touched = [] if artifact is None else util.filter_now(
+        lambda description: not has_same_stat(description), artifact['files'])
+    artifact = util.cond([
+        (lambda: artifact is None, lambda: build_artifact(fpath, rulepath)),
+        (lambda: not all(map(has_same_content, touched)),
+         lambda: build_artifact(fpath, rulepath)),
+        (lambda: touched, lambda: refresh_artifact(fpath, artifact)),
+        (util.truthy, lambda: artifact),
+    ])()
+    return artifact['ruleset'], artifact_rule_files(artifact)
@@ -8,15 +8,18 @@ import os
 # Ruleset                                #
 ##########################################
 
-Ruleset = collections.namedtuple('Ruleset', 'rules')
+# The cache holds what is derived from the rules, such as the order in
+# which they are resolved, so that it is only computed once per ruleset.
+Ruleset = collections.namedtuple('Ruleset', 'rules cache')
 
 
 def make_ruleset():
-    return Ruleset([])
+    return Ruleset([], {})
 
 
 def ruleset_add_rule(ruleset, rule):
     ruleset.rules.append(rule)
+    ruleset.cache.clear()
 
 
 ##########################################
@@ -51,31 +54,53 @@ def make_rule_from_json(json):
 ##########################################
 
 
-def get_element_from_file(fpath, key, default):
-    with open(fpath, 'r') as f:
-        parsed = json.load(f)
-    return parsed.get(key, default)
+# The helpers take a dict of parsed files, keyed on the absolute path,
+# so that a file is only read and parsed once however often it is used.
 
 
-def get_includes_from_file(fpath):
-    return get_element_from_file(fpath, 'includes', [])
+def read_rule_file(fpath, parsed=None):
+    parsed = {} if parsed is None else parsed
+    key = os.path.abspath(fpath)
+    if key not in parsed:
+        with open(fpath, 'r') as f:
+            parsed[key] = json.load(f)
+    return parsed[key]
 
 
-def get_rules_from_file(fpath):
-    return get_element_from_file(fpath, 'rules', [])
+def get_element_from_file(fpath, key, default, parsed=None):
+    return read_rule_file(fpath, parsed).get(key, default)
 
 
-def get_include_group(includes):
-    included_files = set()
+def get_includes_from_file(fpath, parsed=None):
+    return get_element_from_file(fpath, 'includes', [], parsed)
+
+
+def get_rules_from_file(fpath, parsed=None):
+    return get_element_from_file(fpath, 'rules', [], parsed)
+
+
+def get_include_group(includes, parsed=None):
+    # The included files in the order they are found
+    parsed = {} if parsed is None else parsed
+    included_files = []
+    seen = set()
     queue = collections.deque(list(includes)) # Copy into deque
     while queue:
         current = queue.popleft()
-        if current in included_files:
+        if current in seen:
             continue
-        included_files.add(current)
-        added_includes = get_includes_from_file(current)
+        seen.add(current)
+        included_files.append(current)
+        added_includes = get_includes_from_file(current, parsed)
         queue.extend(added_includes)
-    return list(included_files)
+    return included_files
+
+
+def get_rule_files(fpath, parsed=None):
+    # The file itself and every file it includes, directly or not
+    parsed = {} if parsed is None else parsed
+    includes = get_includes_from_file(fpath, parsed)
+    return [fpath] + get_include_group(includes, parsed)
 
 
 ##########################################
@@ -83,19 +108,23 @@ def get_include_group(includes):
 ##########################################
 
 
-def parse_json(json, _from_file=''):
-    # Create ruleset and add rules from json
+def parse_json(json, _from_file='', parsed=None):
+    # Create ruleset and add rules from json. Every file that is read is
+    # added to parsed, keyed on its absolute path.
+    parsed = {} if parsed is None else parsed
+    if _from_file:
+        parsed[os.path.abspath(_from_file)] = json
     ruleset = make_ruleset()
     add_rule = lambda rule: ruleset_add_rule(ruleset, make_rule_from_json(rule))
     rules = json.get('rules', [])
     util.map_now(add_rule, rules)
 
     # Find all includes and include their rules as well
-    include_group = get_include_group(json.get('includes', []))
+    include_group = get_include_group(json.get('includes', []), parsed)
     def is_not_origin(fpath):
         return os.path.abspath(fpath) != os.path.abspath(_from_file)
     def add_rules_from_file(fpath):
-        util.map_now(add_rule, get_rules_from_file(fpath))
+        util.map_now(add_rule, get_rules_from_file(fpath, parsed))
 
     include_group_except_self = filter(is_not_origin, include_group)
     util.map_now(add_rules_from_file, include_group_except_self)
@@ -108,7 +137,6 @@ def parse_string(content):
     return parse_json(parsed)
 
 
-def parse_file(fpath):
-    with open(fpath, 'r') as f:
-        parsed = json.load(f)
-    return parse_json(parsed, _from_file=fpath)
+def parse_file(fpath, parsed=None):
+    parsed = {} if parsed is None else parsed
+    return parse_json(read_rule_file(fpath, parsed), _from_file=fpath, parsed=parsed)
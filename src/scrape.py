@@ -1,14 +1,14 @@
+import argparse
 import configparser
 import collections
+import kattissession
 import pathlib
 import util
 import sys
-import requests
-import threading
+import time
 import json
 
 from urllib.parse import urlparse
-from bs4 import BeautifulSoup
 
 
 ##########################################
@@ -173,111 +173,245 @@ def get_login_parameters(credentials):
     return login_args
 
 
-def login(config):
+def make_session(pool_size=10):
+    # One session for every request, so connections are kept alive and
+    # reused instead of being set up again for each page.
+    return kattissession.make_session(get_headers(), pool_size)
+
+
+def login(config, session):
     credentials = get_login_credentials(config)
     loginurl = credentials.loginurl
     parameters = get_login_parameters(credentials)
-    headers = get_headers()
-    return requests.post(loginurl, data=parameters, headers=headers)
+    return session.post(loginurl, data=parameters)
+
+
+def open_kattis_session(config, pool_size=10, use_cookie_cache=True):
+    # Logs in with the cached cookies when they are still valid, and again
+    # whenever a page is refused
+    credentials = get_login_credentials(config)
+    key = kattissession.session_key(credentials.username, credentials.loginurl)
+    cache_path = kattissession.cookie_cache_path() if use_cookie_cache else None
+    kattis_session = kattissession.make_kattis_session(
+        make_session(pool_size), lambda session: login(config, session), key, cache_path)
+    response = kattissession.session_login(kattis_session)
+    crash_on(response is not None and response.status_code != 200,
+             lambda: ['Could not login, status code {}'.format(response.status_code)])
+    return kattis_session
 
 
 ##########################################
 # Scraping                               #
 ##########################################
 
-def scrape_site(url, cookies, collector, destructor):
-    headers = get_headers()
-    response = requests.get(url, cookies=cookies, headers=headers)
-    soup = BeautifulSoup(response.text, 'lxml')
-    table = soup.find_all('table', class_='table-submissions')[0]
-    rows = table.find_all('tbody')[0].find_all('tr')
-
-    def has_no_entries():
-        return not rows
-    def process_row(row):
-        data_items = row.find_all('td')
-        # This is how the html is divided in the table cells.
-        # Submission ID | Time | Name + link to problem | Status | runtime | language
-        #      0        |   1  |          2             |   3    |   4     |   5
-        problem_id = data_items[2].a['href'].split('/')[-1]
-        problem_name = data_items[2].a.text
-        status = data_items[3]['class']
-        time = data_items[1].text
-        return {
-            'problem_id': problem_id,
-            'problem_name': problem_name,
-            'status': status,
-            'time': time
-        }
-    def process_all_rows():
-        data = util.map_now(process_row, rows)
-        util.map_now(collector, data)
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class ScrapeError(Exception):
+    pass
+
+
+def parse_submissions_page(html):
+    import kattishtml
+    return kattishtml.parse_submission_rows(html)
+
+
+def fetch_page(session, url, stop, retries=3, backoff=0.5):
+    # Retries with an exponential backoff on connection errors and on
+    # responses that say that the server is busy. Gives up early if the
+    # scraping has been stopped.
+    import requests
+    for attempt in range(retries + 1):
+        if stop.is_set():
+            return None
+        try:
+            response = session.get(url)
+            if response.status_code not in RETRY_STATUS_CODES:
+                response.raise_for_status()
+                return response.text
+            error = 'Status code {}'.format(response.status_code)
+        except requests.exceptions.HTTPError as e:
+            raise ScrapeError('Could not fetch {}: {}'.format(url, e))
+        except requests.exceptions.RequestException as e:
+            error = str(e)
+        if attempt < retries:
+            stop.wait(backoff * 2 ** attempt)
+    raise ScrapeError('Could not fetch {}: {}'.format(url, error))
+
+
+def scrape_pages(session, page_url, parse_page=parse_submissions_page, concurrency=10,
+                 max_pages=1000, retries=3, backoff=0.5, on_page=util.noop,
+                 is_last_page=util.falsy, initial_concurrency=None):
+    # Fetches pages 0, 1, 2... with at most `concurrency` requests in flight.
+    # The first page without any rows, or the first page for which
+    # is_last_page(rows) is true, is the end of the history and pages after
+    # it are cancelled. Rows are returned in page order.
+    # When the end is expected early, start with fewer requests in flight
+    # and double them for every page that was not the end.
+    import concurrent.futures
+    import threading
+    stop = threading.Event()
+    rows_by_page = {}
+    end = max_pages
+    window = initial_concurrency or concurrency
+
+    def fetch(page):
+        html = fetch_page(session, page_url(page), stop, retries, backoff)
+        return None if html is None else parse_page(html)
+
+    executor = concurrent.futures.ThreadPoolExecutor(concurrency)
+    pending = {}
+    next_page = 0
+    try:
+        while pending or next_page < end:
+            while next_page < end and len(pending) < window:
+                pending[executor.submit(fetch, next_page)] = next_page
+                next_page += 1
+            done, _ = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                page = pending.pop(future)
+                rows = future.result()
+                if rows is None:
+                    continue
+                if not rows:
+                    end = min(end, page)
+                elif page < end:
+                    rows_by_page[page] = rows
+                    on_page(page, rows)
+                    end = min(end, page + 1) if is_last_page(rows) else end
+                    window = min(concurrency, window * 2)
+            # Nothing after the end is needed, stop waiting for those pages
+            for future, page in list(pending.items()):
+                if page >= end:
+                    future.cancel()
+                    del pending[future]
+    finally:
+        stop.set()
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    pages = sorted(page for page in rows_by_page if page < end)
+    return [row for page in pages for row in rows_by_page[page]]
 
-    return util.cond([
-        (has_no_entries, destructor),
-        (util.truthy, process_all_rows)
-    ])()
 
+##########################################
+# Submission store                       #
+##########################################
+
+
+def full_time(timestr):
+    # Submissions from today only show the time of day, store them with
+    # the date so that they are still correct when read on a later day.
+    return timestr if '-' in timestr else '{} {}'.format(time.strftime('%Y-%m-%d'), timestr)
+
+
+def row_to_submission(row):
+    judgement = 'Accepted' if 'accepted' in row['status'] else 'Wrong Answer'
+    return {
+        'id': row['submission_id'],
+        'time': full_time(row['time']),
+        'judgement': judgement,
+        'problem': row['problem_id']
+    }
 
-def main():
-    check_config_path_or_write_help_message()
-    config = get_config()
-    reply = login(config)
-    def get_profile_page(idx):
-        hostname = urlparse(config.get('kattis', 'loginurl')).netloc
-        username = config.get('user', 'username')
-        return 'https://{}/users/{}?page={}'.format(hostname, username, idx)
 
-    # If someone has over 1000 pages then they surely will have no problem
-    # finding out how this looks and rewriting this to work for them.
-    one_thousand_pages = [get_profile_page(idx) for idx in range(1000)]
-    allpages = collections.deque(one_thousand_pages)
-    collected = collections.deque()
-    page1 = allpages[0]
-    def collector(info):
-        collected.append(info)
-        if len(collected) % 100 == 0:
-            print('Collected at least {} entries'.format(100 * (len(collected) // 100)), file=sys.stderr)
-    def destructor():
-        return 'IShouldStopNow'
-
-    def thread_main():
-        for idx in range(100):
-            try:
-                page = allpages.popleft()
-            except IndexError:
-                return
-            result = scrape_site(page, reply.cookies, collector, destructor)
-            if result == 'IShouldStopNow':
-                return
-    threads = [threading.Thread(target=thread_main) for _ in range(10)]
-    start_thread = lambda t: t.start()
-    util.map_now(start_thread, threads)
-    for thread in threads:
-        thread.join()
+def make_export(submissions):
     student = {
         'username': 'me',
         'name': 'Me',
         'email': '',
-        'submissions': []
+        'submissions': submissions
     }
-
-    for submission in collected:
-        judgement = 'Accepted' if 'accepted' in submission['status'] else 'Wrong Answer'
-        item = {
-            'time': submission['time'],
-            'judgement': judgement,
-            'problem': submission['problem_id']
-        }
-        student['submissions'].append(item)
-
-    data = {
+    return {
         "students": [
             student
         ],
         "sessions": []
     }
-    print(json.dumps(data))
+
+
+def submissions_to_export(collected):
+    return make_export(util.map_now(row_to_submission, collected))
+
+
+def read_stored_submissions(fpath):
+    # Returns the stored submissions, newest first, or None if there are
+    # none that can be continued from (such as files from before the
+    # submission ids were kept).
+    try:
+        with open(fpath, 'r') as f:
+            stored = json.load(f)
+        submissions = stored['students'][0]['submissions']
+    except (OSError, ValueError, KeyError, IndexError):
+        return None
+    has_ids = all('id' in submission for submission in submissions)
+    return submissions if has_ids else None
+
+
+def merge_submissions(stored, collected):
+    # Scraped rows are newest first, so the new ones go before the stored
+    known_ids = set(submission['id'] for submission in stored)
+    is_new = lambda submission: submission['id'] not in known_ids
+    new = util.filter_now(is_new, util.map_now(row_to_submission, collected))
+    return new + stored
+
+
+def write_export(fpath, export):
+    util.atomic_write(fpath, lambda f: json.dump(export, f))
+
+
+##########################################
+# Main                                   #
+##########################################
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Download your kattis submissions')
+    parser.add_argument('--output', help='File to write to instead of printing the data')
+    parser.add_argument('--since-last', action='store_true',
+                        help='Only download submissions newer than those already in --output')
+    parser.add_argument('--no-cookie-cache', action='store_true',
+                        help='Log in again instead of using the cached login cookies')
+    args = parser.parse_args()
+    crash_on(args.since_last and not args.output,
+             lambda: ['--since-last needs an --output file to continue from'])
+
+    check_config_path_or_write_help_message()
+    config = get_config()
+    import kattishtml
+    session = open_kattis_session(config, use_cookie_cache=not args.no_cookie_cache)
+    def get_profile_page(idx):
+        hostname = urlparse(config.get('kattis', 'loginurl')).netloc
+        username = config.get('user', 'username')
+        return 'https://{}/users/{}?page={}'.format(hostname, username, idx)
+
+    collected_count = [0]
+    def report_progress(page, rows):
+        before = collected_count[0] // 100
+        collected_count[0] += len(rows)
+        if collected_count[0] // 100 > before:
+            print('Collected at least {} entries'.format(100 * (collected_count[0] // 100)), file=sys.stderr)
+
+    stored = read_stored_submissions(args.output) if args.since_last else None
+    known_ids = set() if stored is None else set(s['id'] for s in stored)
+    def has_known_submission(rows):
+        return any(row['submission_id'] in known_ids for row in rows)
+    # With stored submissions the first page is likely the only new one
+    initial_concurrency = 1 if known_ids else None
+
+    try:
+        collected = scrape_pages(session, get_profile_page, on_page=report_progress,
+                                 is_last_page=has_known_submission,
+                                 initial_concurrency=initial_concurrency)
+    except (ScrapeError, kattishtml.PageError) as e:
+        crash_on(True, lambda: [str(e)])
+
+    submissions = merge_submissions(stored or [], collected)
+    export = make_export(submissions)
+    util.cond([
+        (lambda: args.output, lambda: write_export(args.output, export)),
+        (util.truthy, lambda: print(json.dumps(export)))
+    ])()
 
 
 if __name__ == '__main__':
@@ -4,17 +4,12 @@ import argparse
 import os
 import sys
 import re
-import webbrowser
 
 try:
     from urlparse import urlparse as UrlParse
 except ImportError:
     from urllib.parse import urlparse as UrlParse
 
-from bs4 import BeautifulSoup
-import requests
-import requests.exceptions
-
 
 # Python 2/3 compatibility
 if sys.version_info[0] >= 3:
@@ -88,10 +83,11 @@ submissionurl: https://<kattis>/submit''')
     return cfg
 
 
-def login(login_url, username, password=None, token=None):
+def login(login_url, username, password=None, token=None, session=None):
     """Log in to Kattis.
 
-    At least one of password or token needs to be provided.
+    At least one of password or token needs to be provided. With a
+    session the cookies are kept in it.
 
     Returns a requests.Response with cookies needed to be able to submit
     """
@@ -101,10 +97,11 @@ def login(login_url, username, password=None, token=None):
     if token:
         login_args['token'] = token
 
-    return requests.post(login_url, data=login_args, headers=_HEADERS)
+    import requests
+    return (session or requests).post(login_url, data=login_args, headers=_HEADERS)
 
 
-def login_from_config(cfg):
+def login_from_config(cfg, session=None):
     """Log in to Kattis using the access information in a kattisrc file
 
     Returns a requests.Response with cookies needed to be able to submit
@@ -127,55 +124,64 @@ KATTIS password).
 Please download a new .kattisrc file''')
 
     loginurl = get_url(cfg, 'loginurl', 'login')
-    return login(loginurl, username, password, token)
+    return login(loginurl, username, password, token, session)
+
+
+def open_kattis_session(cfg, use_cookie_cache=True, pool_size=10):
+    """Returns a pooled session for Kattis and the login reply, which is
+    None when the cached login cookies are still valid. Requests that are
+    refused with 403 log in again."""
+    import kattissession
+    key = kattissession.session_key(cfg.get('user', 'username'),
+                                    get_url(cfg, 'loginurl', 'login'))
+    cache_path = kattissession.cookie_cache_path() if use_cookie_cache else None
+    kattis_session = kattissession.make_kattis_session(
+        kattissession.make_session(_HEADERS, pool_size),
+        lambda session: login_from_config(cfg, session), key, cache_path)
+    return kattis_session, kattissession.session_login(kattis_session)
 
-def get_submissions_with_config(cfg):
+
+def get_submissions_with_config(cfg, use_cookie_cache=True):
     """Uses a config object to return all submissions for a user"""
-    login_reply = login_from_config(cfg)
-    if login_reply.status_code == 200:
-        cookies = login_reply.cookies
+    session, login_reply = open_kattis_session(cfg, use_cookie_cache)
+    if login_reply is None or login_reply.status_code == 200:
         username = cfg.get('user', 'username')
         loginurl = get_url(cfg, 'loginurl', 'login')
         base = UrlParse(loginurl).netloc
         profile = 'https://{}/users/{}'.format(base, username)
-        return get_all_submissions(profile, cookies)
+        return get_all_submissions(profile, None, session=session)
     else:
         print('Could not login!')
         sys.exit(1)
 
-def get_all_submissions(profile_url, cookies, verbose=True):
-    """Returns all submissions from a user using the profile url and the
-    login cookie provided."""
+def get_all_submissions(profile_url, cookies, verbose=True, session=None):
+    """Returns all accepted submissions from a user using the profile url
+    and the login cookie provided (or the cookies of session), newest
+    first, as tuples of time, problem id, problem name and submission id."""
+    import kattishtml
+    import requests
     page = 0
     collect = []
     while True:
         url = '{}?page={}'.format(profile_url, page)
-        response = requests.get(url, cookies=cookies, headers=_HEADERS)
-        soup = BeautifulSoup(response.text, 'lxml')
-        table = soup.find_all('table', class_='table-submissions')[0]
-        rows = table.find_all('tbody')[0].find_all('tr')
+        response = (session or requests).get(url, cookies=cookies, headers=_HEADERS)
+        rows = kattishtml.parse_submission_rows(response.text)
         if not rows:
             return collect
         for row in rows:
-            data_items = row.find_all('td')
-            # This is how the html is divided in the table cells.
-            # Submission ID | Time | Name + link to problem | Status | runtime | language
-            #      0        |   1  |          2             |   3    |   4     |   5
-            problem_id = data_items[2].a['href'].split('/')[-1]
-            problem_name = data_items[2].a.text
-            accepted = 'accepted' in data_items[3]['class']
-            time = data_items[1].text
-            if accepted:
-                collect.append((time, problem_id, problem_name))
+            if 'accepted' in row['status']:
+                collect.append((row['time'], row['problem_id'], row['problem_name'],
+                                row['submission_id']))
         if verbose:
             print('Collected page #{} and found {} accepted submissions'.format(page + 1, len(collect)))
         page += 1
 
-def submit(submit_url, cookies, problem, language, files, mainclass='', tag=''):
+def submit(submit_url, cookies, problem, language, files, mainclass='', tag='',
+           session=None):
     """Make a submission.
 
-    The url_opener argument is an OpenerDirector object to use (as
-    returned by the login() function)
+    The cookies are those of the login() reply, or None to use the
+    cookies of session.
 
     Returns the requests.Result from the submission
     """
@@ -196,7 +202,166 @@ def submit(submit_url, cookies, problem, language, files, mainclass='', tag=''):
                                sub_file.read(),
                                'application/octet-stream')))
 
-    return requests.post(submit_url, data=data, files=sub_files, cookies=cookies, headers=_HEADERS)
+    import requests
+    return (session or requests).post(submit_url, data=data, files=sub_files, cookies=cookies,
+                                      headers=_HEADERS)
+
+
+def python_language(cfg):
+    """Returns the Python language to submit as, from the python-version
+    in the config or else the version running this script"""
+    python_version = str(sys.version_info[0])
+    try:
+        python_version = cfg.get('defaults', 'python-version')
+    except configparser.Error:
+        pass
+
+    if python_version not in ['2', '3']:
+        raise ConfigError('python-version in .kattisrc must be 2 or 3')
+    return 'Python ' + python_version
+
+
+def guess_submission(path, cfg, problem=None, language=None):
+    """Guesses the problem and language (unless given) and the mainclass
+    of a single file submission from its name, as (problem, language,
+    mainclass, files). The language is None when it can not be guessed."""
+    guessed, ext = os.path.splitext(os.path.basename(path))
+    problem = problem or guessed
+    guessed_language = _LANGUAGE_GUESS.get(ext, None)
+    mainclass = guessed if guessed_language in _GUESS_MAINCLASS else None
+    if not language and guessed_language == 'Python':
+        guessed_language = python_language(cfg)
+    return problem, language or guessed_language, mainclass, [path]
+
+
+##########################################
+# Batch submissions                      #
+##########################################
+
+# A batch is a directory with one file for each problem, named after the
+# problem, or a manifest with one file on each line, optionally followed
+# by the problem. Paths in a manifest are relative to it and lines that
+# start with # are skipped. Headers are never submitted on their own.
+_BATCH_SKIPPED = {'.h'}
+
+
+def read_batch_paths(batch):
+    if os.path.isdir(batch):
+        names = sorted(os.listdir(batch))
+        paths = [os.path.join(batch, name) for name in names]
+        return [(path, None) for path in paths if os.path.isfile(path)]
+    base = os.path.dirname(batch)
+    paths = []
+    with open(batch) as manifest:
+        for line in manifest:
+            parts = line.split()
+            if not parts or parts[0].startswith('#'):
+                continue
+            problem = parts[1] if len(parts) > 1 else None
+            paths.append((os.path.join(base, parts[0]), problem))
+    return paths
+
+
+def read_batch(batch, cfg):
+    """Returns the submissions of a batch, as guessed by guess_submission,
+    and the paths for which no language could be guessed"""
+    submissions = []
+    unknown = []
+    for path, problem in read_batch_paths(batch):
+        if os.path.splitext(path)[1] in _BATCH_SKIPPED:
+            continue
+        submission = guess_submission(path, cfg, problem)
+        if submission[1] is None:
+            unknown.append(path)
+        else:
+            submissions.append(submission)
+    return submissions, unknown
+
+
+def submission_id_of(text):
+    m = re.search(r'Submission ID: (\d+)', text)
+    return m.group(1) if m else None
+
+
+def submit_one(session, submit_url, submission, tag=''):
+    """Returns the submission id, or None and the reason it failed"""
+    import requests
+    problem, language, mainclass, files = submission
+    try:
+        result = submit(submit_url, None, problem, language, files, mainclass or '', tag,
+                        session)
+    except (requests.exceptions.RequestException, IOError) as err:
+        return None, 'Connection failed: {}'.format(err)
+    if result.status_code != 200:
+        return None, 'Status code {}'.format(result.status_code)
+    plain_result = result.content.decode('utf-8')
+    submission_id = submission_id_of(plain_result)
+    if submission_id is None:
+        return None, plain_result.replace('<br />', ' ').strip()
+    return submission_id, ''
+
+
+def submit_batch(session, submit_url, submissions, concurrency=4, tag=''):
+    """Uploads the submissions with at most concurrency of them in flight,
+    all over the same session. Returns (submission, submission id,
+    message) for each, in the order of the submissions."""
+    import concurrent.futures
+    with concurrent.futures.ThreadPoolExecutor(max(1, concurrency)) as executor:
+        results = executor.map(lambda s: submit_one(session, submit_url, s, tag), submissions)
+        return [(submission, submission_id, message)
+                for submission, (submission_id, message) in zip(submissions, results)]
+
+
+def print_batch_summary(results):
+    for (problem, language, _, files), submission_id, message in results:
+        print('{} {} {} {}'.format(problem.ljust(30), language.ljust(12),
+                                   (submission_id or 'FAILED').ljust(10), message).rstrip())
+    failed = sum(1 for _, submission_id, _ in results if submission_id is None)
+    print('{} submitted, {} failed'.format(len(results) - failed, failed))
+
+
+def confirm_batch_or_die(submissions):
+    for problem, language, mainclass, files in submissions:
+        print('{} {} {}'.format(problem.ljust(30), language.ljust(12), ', '.join(files)))
+    print('Submit these {} problems (y/N)?'.format(len(submissions)))
+    if sys.stdin.readline().upper()[:-1] != 'Y':
+        print('Cancelling')
+        sys.exit(1)
+
+
+def main_batch(args, cfg):
+    try:
+        submissions, unknown = read_batch(args.batch, cfg)
+    except (ConfigError, IOError) as exc:
+        print(exc)
+        sys.exit(1)
+    for path in unknown:
+        print('Skipping %s, failed to guess its language' % (path,))
+    if not submissions:
+        print('Nothing to submit in', args.batch)
+        sys.exit(1)
+
+    if not args.force:
+        confirm_batch_or_die(submissions)
+
+    import requests
+    try:
+        session, login_reply = open_kattis_session(cfg, not args.no_cookie_cache,
+                                                   args.concurrency)
+    except ConfigError as exc:
+        print(exc)
+        sys.exit(1)
+    except requests.exceptions.RequestException as err:
+        print('Login connection failed:', err)
+        sys.exit(1)
+    if login_reply is not None and login_reply.status_code != 200:
+        print('Login failed, status code:', login_reply.status_code)
+        sys.exit(1)
+
+    submit_url = get_url(cfg, 'submissionurl', 'submit')
+    results = submit_batch(session, submit_url, submissions, args.concurrency, args.tag or '')
+    print_batch_summary(results)
+    sys.exit(0 if all(submission_id for _, submission_id, _ in results) else 1)
 
 
 def confirm_or_die(problem, language, files, mainclass, tag):
@@ -222,6 +387,7 @@ def open_submission(submit_response, cfg):
         print('Open in browser (y/N)?')
         if sys.stdin.readline().upper()[:-1] == 'Y':
             url = '%s/%s' % (submissions_url, submission_id)
+            import webbrowser
             webbrowser.open(url)
 
 def print_submissions(submissions):
@@ -262,6 +428,14 @@ Overrides default guess (based on suffix of first filename)''')
     parser.add_argument('-s', '--submissions',
                         help='Print all accepted submissions',
                         action='store_true')
+    parser.add_argument('--no-cookie-cache',
+                        help='Log in again instead of using the cached login cookies',
+                        action='store_true')
+    parser.add_argument('--batch',
+                        help='''Submit every file in this directory, or every file listed
+in this manifest, as its own problem''')
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help='Number of batch submissions to upload at once')
     parser.add_argument('--files', nargs='+')
 
     args = parser.parse_args()
@@ -274,40 +448,29 @@ Overrides default guess (based on suffix of first filename)''')
         sys.exit(1)
 
     if args.submissions:
-        subs = get_submissions_with_config(cfg)
+        subs = get_submissions_with_config(cfg, not args.no_cookie_cache)
         print_submissions(subs)
         sys.exit(0)
+    elif args.batch:
+        main_batch(args, cfg)
     else:
         if not files:
-            print('Must either supply files for submission or -s flag for listing accepted solutions!')
+            print('Must either supply files or --batch for submission or -s flag for listing accepted solutions!')
             sys.exit(1)
 
-    problem, ext = os.path.splitext(os.path.basename(args.files[0]))
-    language = _LANGUAGE_GUESS.get(ext, None)
-    mainclass = problem if language in _GUESS_MAINCLASS else None
+    try:
+        problem, language, mainclass, _ = guess_submission(args.files[0], cfg, args.problem,
+                                                           args.language)
+    except ConfigError as exc:
+        print(exc)
+        sys.exit(1)
     tag = args.tag
 
-    if args.problem:
-        problem = args.problem
-
     if args.mainclass is not None:
         mainclass = args.mainclass
 
-    if args.language:
-        language = args.language
-    elif language == 'Python':
-        python_version = str(sys.version_info[0])
-        try:
-            python_version = cfg.get('defaults', 'python-version')
-        except configparser.Error:
-            pass
-
-        if python_version not in ['2', '3']:
-            print('python-version in .kattisrc must be 2 or 3')
-            sys.exit(1)
-        language = 'Python ' + python_version
-
     if language is None:
+        _, ext = os.path.splitext(args.files[0])
         print('''\
 No language specified, and I failed to guess language from filename
 extension "%s"''' % (ext,))
@@ -315,8 +478,12 @@ extension "%s"''' % (ext,))
 
     files = list(set(args.files))
 
+    # requests is only imported once there is something to send, so -h and
+    # mistakes in the arguments are answered without waiting for it.
+    import requests
+
     try:
-        login_reply = login_from_config(cfg)
+        session, login_reply = open_kattis_session(cfg, not args.no_cookie_cache)
     except ConfigError as exc:
         print(exc)
         sys.exit(1)
@@ -324,7 +491,7 @@ extension "%s"''' % (ext,))
         print('Login connection failed:', err)
         sys.exit(1)
 
-    if not login_reply.status_code == 200:
+    if login_reply is not None and not login_reply.status_code == 200:
         print('Login failed.')
         if login_reply.status_code == 403:
             print('Incorrect username or password/token (403)')
@@ -341,12 +508,13 @@ extension "%s"''' % (ext,))
 
     try:
         result = submit(submit_url,
-                        login_reply.cookies,
+                        None,
                         problem,
                         language,
                         files,
                         mainclass,
-                        tag)
+                        tag,
+                        session)
     except requests.exceptions.RequestException as err:
         print('Submit connection failed:', err)
         sys.exit(1)
@@ -358,7 +526,7 @@ extension "%s"''' % (ext,))
         elif result.status_code == 404:
             print('Incorrect submit URL (404)')
         else:
-            print('Status code:', login_reply.status_code)
+            print('Status code:', result.status_code)
         sys.exit(1)
 
     plain_result = result.content.decode('utf-8').replace('<br />', '\n')
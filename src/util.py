@@ -1,4 +1,5 @@
 import itertools
+import os
 
 def map_now(function, *iterables):
     '''A map equivalent that applies directly.'''
@@ -58,3 +59,41 @@ def constant(value):
     def inner(*args, **kwargs):
         return value
     return inner
+
+def default_cache_directory():
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'kattis-cli')
+
+def atomic_write(fpath, write, binary=False, permissions=0o666):
+    '''Calls write with a temporary file that then replaces fpath, so that
+    a crash never leaves half a file. The temporary file is removed if
+    anything goes wrong.'''
+    temporary = '{}.{}.tmp'.format(fpath, os.getpid())
+    try:
+        fd = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, permissions)
+        with os.fdopen(fd, 'wb' if binary else 'w') as f:
+            write(f)
+        os.replace(temporary, fpath)
+    except BaseException:
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+        raise
+
+def read_pickle(fpath, default=None):
+    '''Returns the value pickled in fpath, or default when the file is
+    missing or can not be read, such as one written by older code.'''
+    import pickle
+    try:
+        with open(fpath, 'rb') as f:
+            return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        return default
+
+def write_pickle(fpath, value):
+    '''Pickles value into fpath, making its directory if needed. Raises
+    OSError when it can not be written.'''
+    import pickle
+    os.makedirs(os.path.dirname(fpath), exist_ok=True)
+    atomic_write(fpath, lambda f: pickle.dump(value, f, pickle.HIGHEST_PROTOCOL), binary=True)
@@ -0,0 +1,118 @@
+import http.server
+import threading
+import urllib.parse
+
+
+def submission_row(submission_id, problem_id, status):
+    # Same layout as the table-submissions rows on the kattis profile pages
+    return '''
+    <tr data-submission-id="{0}">
+      <td><a href="/submissions/{0}">{0}</a></td>
+      <td>2017-01-01 08:{1:02}:00</td>
+      <td><a href="/problems/{2}">Problem {2}</a></td>
+      <td class="status middle {3}"><span>{3}</span></td>
+      <td class="runtime">0.01&nbsp;s</td>
+      <td>Python 3</td>
+    </tr>'''.format(submission_id, submission_id % 60, problem_id, status)
+
+
+def submissions_page(rows):
+    return '''<html><body>
+    <table class="table-submissions">
+      <thead><tr><th>ID</th><th>Date</th><th>Problem</th><th>Status</th></tr></thead>
+      <tbody>{}</tbody>
+    </table></body></html>'''.format(''.join(rows))
+
+
+def make_pages(page_count, rows_per_page):
+    pages = []
+    submission_id = page_count * rows_per_page
+    for page in range(page_count):
+        rows = []
+        for _ in range(rows_per_page):
+            status = 'accepted' if submission_id % 3 else 'rejected'
+            rows.append(submission_row(submission_id, 'problem{}'.format(submission_id % 7), status))
+            submission_id -= 1
+        pages.append(submissions_page(rows))
+    return pages
+
+
+class StubKattis:
+    """A local stand in for the kattis pages, serving profile pages from
+    a list of html strings. Pages after the last one are empty. With
+    require_login pages are refused with 403 unless the cookie set by the
+    last login is sent."""
+
+    def __init__(self, pages, failures=None, require_login=False):
+        self.pages = pages
+        self.require_login = require_login
+        self.logins = 0
+        # path -> number of times to answer with 503 before succeeding
+        self.failures = dict(failures or {})
+        self.requests = []
+        self.posts = []
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def send(self, status, body, headers=()):
+                content = body.encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(content)))
+                for key, value in headers:
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(content)
+
+            def do_GET(self):
+                with stub.lock:
+                    stub.requests.append(self.path)
+                    failures = stub.failures.get(self.path, 0)
+                    if failures:
+                        stub.failures[self.path] = failures - 1
+                if failures:
+                    return self.send(503, 'busy')
+                cookie = 'session=stub{}'.format(stub.logins)
+                if stub.require_login and cookie not in self.headers.get('Cookie', ''):
+                    return self.send(403, 'Not logged in')
+                query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+                page = int(query.get('page', ['0'])[0])
+                html = stub.pages[page] if page < len(stub.pages) else submissions_page([])
+                self.send(200, html)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                body = self.rfile.read(length)
+                with stub.lock:
+                    stub.posts.append((self.path, body))
+                    submission_id = len(stub.posts)
+                if self.path.startswith('/submit'):
+                    cookie = 'session=stub{}'.format(stub.logins)
+                    if stub.require_login and cookie not in self.headers.get('Cookie', ''):
+                        return self.send(403, 'Not logged in')
+                    return self.send(200, 'Submission received.<br />Submission ID: {}.'.format(
+                        submission_id))
+                with stub.lock:
+                    stub.logins += 1
+                    cookie = 'session=stub{}; Path=/'.format(stub.logins)
+                self.send(200, 'Login successful', [('Set-Cookie', cookie)])
+
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def url(self, path):
+        return 'http://127.0.0.1:{}{}'.format(self.server.server_port, path)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
@@ -1,3 +1,6 @@
+import json
+import pickle
+import time
 import aaps
 import rules
 import resolver
@@ -10,12 +13,16 @@ def get_ruleset_from_file(fpath):
     return rules.parse_file(rule_path.as_posix())
 
 
-def resolve_for_result(kattis, ruleset):
+def make_plugin_context(kattis):
     context = resolver.make_context()
     plugins = kattis.get_plugins()
     func = lambda c, h: resolver.context_add_plugin(context, c, h)
     util.starmap_now(func, plugins)
-    return resolver.resolve(ruleset, context)
+    return context
+
+
+def resolve_for_result(kattis, ruleset):
+    return resolver.resolve(ruleset, make_plugin_context(kattis))
 
 
 def test_kattis_result():
@@ -111,3 +118,116 @@ def test_lab_with_big_points():
 
     assert len(result.goals) == 1
     assert result.goals[0].points == 1 + 2 + 42
+
+
+def test_compiled_uppgift():
+    ruleset = get_ruleset_from_file('test_uppgift.json')
+    program = resolver.compile_ruleset(ruleset, make_plugin_context(aaps.KattisResult()))
+
+    kattis = aaps.KattisResult()
+    kattis.add_AC('helloworld', '01-01-2017 07:00')
+    kattis.add_AC('helloworld2', '01-01-2017 07:00')
+
+    result = resolver.resolve(ruleset, make_plugin_context(kattis), program)
+
+    assert len(result.goals) == 1
+    assert result.goals[0].points == 2
+
+
+def test_kattis_result_index():
+    result = aaps.KattisResult()
+    result.add_WA('helloworld', '01-01-2017 06:00')
+    result.add_AC('helloworld', '01-01-2017 09:00')
+    result.add_AC('helloworld', '01-01-2017 08:00')
+    result.add_TLE('other', '01-01-2017 08:00')
+    result.add_submission(aaps.make_submission('other', '01-01-2017 08:00', ''))
+
+    assert len(result.solutions_for('helloworld')) == 2
+    assert result.first_AC_for('helloworld') == aaps.time_minutes('01-01-2017 08:00')
+    assert result.WA_count_for('helloworld') == 1
+    assert len(result.attempts_for('helloworld')) == 3
+    assert len(result.attempts_for('other')) == 1
+    assert not result.has_solved('other')
+    assert not result.has_attempted('missing')
+    assert result.solved_before('helloworld', '01-01-2017 08:30')
+    assert not result.solved_only_after('helloworld', '01-01-2017 08:30')
+
+
+def test_time_minutes():
+    assert aaps.time_minutes('1-2-2017 8:05') == aaps.time_minutes('01-02-2017 08:05')
+    assert aaps.time_minutes('31-01-2017 23:59') + 1 == aaps.time_minutes('01-02-2017 00:00')
+    assert aaps.time_compare('01-01-2017 08:00', aaps.time_minutes('01-01-2017 08:01'))
+    assert not aaps.time_compare('01-01-2017 08:00', '01-01-2017 08:00')
+
+
+def test_read_exported_kattis_file(tmpdir):
+    start = 1500000000
+    content = {
+        'sessions': [{
+            'starttime': str(start),
+            'results': [{
+                'members': ['first', 'missing'],
+                'problems': [
+                    {'problem_name': 'sessionproblem', 'solve_time': 10},
+                    {'problem_name': 'unsolved'}
+                ]
+            }]
+        }],
+        'students': [
+            {'username': 'first', 'name': 'First', 'submissions': [
+                {'problem': 'hello', 'judgement': 'Accepted', 'time': '2017-01-01 08:00:00'}
+            ]},
+            {'username': 'second', 'name': 'Second'}
+        ]
+    }
+    fpath = tmpdir.join('export.json')
+    fpath.write(json.dumps(content))
+
+    exported = aaps.read_exported_kattis_file(str(fpath))
+
+    assert [s.username for s in exported.students] == ['first', 'second']
+    first, second = exported.students
+    assert [s.id for s in first.submissions] == ['hello', 'sessionproblem']
+    assert first.submissions[0].time == aaps.time_minutes('01-01-2017 08:00')
+    expected = aaps.struct_to_minutes(time.localtime(start + 10 * 60))
+    assert first.submissions[1].time == expected
+    assert second.submissions == []
+
+    only_first = lambda username, name: name == 'First'
+    filtered = list(aaps.iterate_exported_kattis_file(str(fpath), only_first))
+    assert filtered == [first]
+
+
+def test_only_asking_sessions_are_impure():
+    kattis = aaps.KattisResult()
+    assert not resolver.make_context().impure
+    assert not make_plugin_context(kattis).impure
+    kattis.resolve_sessions_with_input()
+    assert make_plugin_context(kattis).impure
+
+
+def test_submission_list_reads_like_a_list():
+    submissions = [aaps.make_submission('hello', '01-01-2017 08:00', 'AC'),
+                   aaps.make_submission('world', '01-01-2017 07:00', '')]
+    stored = aaps.SubmissionList(submissions)
+    assert stored == submissions
+    assert len(stored) == 2 and stored[-1] == submissions[-1]
+    assert stored[1:] == submissions[1:]
+    assert repr(stored) == repr(submissions)
+    assert pickle.loads(pickle.dumps(stored)) == submissions
+
+
+def test_kattis_result_from_submission_list():
+    student = aaps.make_student('ada', 'Ada')
+    add = lambda s: aaps.student_add_submission(student, aaps.make_submission(*s))
+    util.map_now(add, [('hello', '01-01-2017 09:00', 'AC'), ('hello', '01-01-2017 07:00', 'WA'),
+                       ('hello', '01-01-2017 08:00', 'AC'), ('other', '01-01-2017 07:00', '')])
+    one_by_one = aaps.KattisResult()
+    util.map_now(one_by_one.add_submission, student.submissions)
+    copied = aaps.KattisResult()
+    copied.add_submission_list(student.submissions)
+    for kattis in [one_by_one, copied]:
+        assert kattis.first_AC == {'hello': aaps.time_minutes('01-01-2017 08:00')}
+        assert len(kattis.solutions_for('hello')) == 2
+        assert kattis.WA_count_for('hello') == 1
+        assert not kattis.has_attempted('other')
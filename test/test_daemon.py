@@ -0,0 +1,123 @@
+import daemon
+import json
+import os
+import pytest
+import stat
+import threading
+import urllib.error
+import urllib.request
+from utiltest import *
+
+
+def make_state(tmpdir):
+    fpath = tmpdir.join('export.json')
+    write_export(fpath, [('ada', ['helloworld']), ('bob', [])], 10 ** 18)
+    rulepath = get_rule_file('test_uppgift.json').as_posix()
+    return fpath, daemon.make_grading_state(rulepath, str(fpath), use_cache=False)
+
+
+def points(grade):
+    return [goal['points'] for goal in grade['goals']]
+
+
+def test_state_grades_students(tmpdir):
+    fpath, state = make_state(tmpdir)
+    assert daemon.refresh_state(state) == 2
+    assert [grade['username'] for grade in daemon.state_get_grades(state)] == ['ada', 'bob']
+    assert points(daemon.state_get_grade(state, 'ada')) == [1]
+    assert daemon.state_get_grade(state, 'missing') is None
+    assert daemon.refresh_state(state) == 0
+
+
+def test_state_only_regrades_changed_students(tmpdir):
+    fpath, state = make_state(tmpdir)
+    daemon.refresh_state(state)
+    ada = daemon.state_get_grade(state, 'ada')
+
+    write_export(fpath, [('ada', ['helloworld']), ('bob', ['helloworld', 'helloworld2']),
+                         ('cid', [])], 2 * 10 ** 18)
+    assert daemon.refresh_state(state) == 2
+    assert daemon.state_get_grade(state, 'ada') is ada
+    assert points(daemon.state_get_grade(state, 'bob')) == [2]
+    assert points(daemon.state_get_grade(state, 'cid')) == [0]
+    # Only what the queries need is kept between refreshes
+    assert all(entry[1].context is None for entry in state.results.values())
+
+
+def test_server_answers_queries(tmpdir):
+    fpath, state = make_state(tmpdir)
+    daemon.refresh_state(state)
+    server = daemon.make_server(daemon.make_handler(state), port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    try:
+        with urllib.request.urlopen(url + '/grades/ada?detailed=1') as response:
+            grade = json.loads(response.read().decode('utf-8'))
+        assert grade['goals'][0]['rules'][0]['problems'][0]['AC']
+        with urllib.request.urlopen(url + '/status') as response:
+            assert json.loads(response.read().decode('utf-8'))['students'] == 2
+        try:
+            urllib.request.urlopen(url + '/grades/missing')
+            assert False, 'Expected a 404'
+        except urllib.error.HTTPError as error:
+            assert error.code == 404
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_queries_are_answered_during_a_refresh(tmpdir, monkeypatch):
+    fpath, state = make_state(tmpdir)
+    daemon.refresh_state(state)
+    write_export(fpath, [('ada', ['helloworld', 'helloworld2']), ('bob', [])], 2 * 10 ** 18)
+
+    grading = threading.Event()
+    release = threading.Event()
+    grade_student = daemon.grade_student
+    def slow_grade_student(loaded, student):
+        grading.set()
+        release.wait(10)
+        return grade_student(loaded, student)
+    monkeypatch.setattr(daemon, 'grade_student', slow_grade_student)
+
+    refresh = threading.Thread(target=daemon.refresh_state, args=(state,))
+    refresh.start()
+    try:
+        assert grading.wait(10)
+        # The old results are served while ada is regraded
+        assert points(daemon.state_get_grade(state, 'ada')) == [1]
+    finally:
+        release.set()
+        refresh.join()
+    assert points(daemon.state_get_grade(state, 'ada')) == [2]
+
+
+def test_socket_path_must_be_a_socket(tmpdir):
+    fpath, state = make_state(tmpdir)
+    with pytest.raises(SystemExit):
+        daemon.make_server(daemon.make_handler(state), socket_path=str(fpath))
+    assert fpath.check(file=1)
+
+    socket_path = str(tmpdir.join('grading.sock'))
+    for _ in range(2):
+        # A socket left behind is replaced
+        daemon.make_server(daemon.make_handler(state), socket_path=socket_path).server_close()
+    mode = os.lstat(socket_path).st_mode
+    assert stat.S_ISSOCK(mode)
+    assert stat.S_IMODE(mode) == 0o600
+
+
+def test_watcher_keeps_going_after_errors(tmpdir, monkeypatch, capsys):
+    fpath, state = make_state(tmpdir)
+    stop = threading.Event()
+    errors = [KeyError('students'), TypeError('bad submission')]
+    def refresh_state(state):
+        if not errors:
+            stop.set()
+            return 0
+        raise errors.pop(0)
+    monkeypatch.setattr(daemon, 'refresh_state', refresh_state)
+    daemon.watch_state(state, 0.001, stop)
+    err = capsys.readouterr().err
+    assert 'KeyError' in err and 'TypeError' in err
@@ -0,0 +1,48 @@
+import aaps
+import gradecache
+import resolver
+from utiltest import *
+
+
+def test_fingerprint_follows_included_files(tmpdir):
+    rulepath, _ = write_rules(tmpdir, 1)
+    before = gradecache.ruleset_fingerprint(rulepath, [resolver])
+    assert before == gradecache.ruleset_fingerprint(rulepath, [resolver])
+
+    write_rules(tmpdir, 2)
+    assert before != gradecache.ruleset_fingerprint(rulepath, [resolver])
+    assert before != gradecache.ruleset_fingerprint(rulepath, [resolver, aaps])
+
+
+def test_cache_round_trip(tmpdir):
+    fpath = gradecache.grade_cache_path(str(tmpdir.join('cache')), 'fingerprint')
+    student = make_student('user', [('hello', '01-01-2017 08:00', 'AC')])
+    result = resolver.Result()
+    resolver.result_add_goal(result, resolver.make_goal('goal', 'Goal'))
+
+    cache = gradecache.load_grade_cache(fpath)
+    assert gradecache.grade_cache_get(cache, student) is None
+    gradecache.grade_cache_put(cache, student, result)
+    gradecache.save_grade_cache(cache)
+
+    cache = gradecache.load_grade_cache(fpath)
+    cached = gradecache.grade_cache_get(cache, student)
+    assert [goal.id for goal in cached.goals] == ['goal']
+    # New submissions make the cached result invalid
+    assert gradecache.grade_cache_get(cache, make_student('user', [('hello', '01-01-2017 09:00', 'AC')])) is None
+
+
+def test_broken_cache_is_ignored(tmpdir):
+    fpath = tmpdir.join('grades.pickle')
+    fpath.write('not a pickle')
+    cache = gradecache.load_grade_cache(str(fpath))
+    assert cache.entries == {}
+
+
+def test_unwritable_cache_is_not_saved(tmpdir, capsys):
+    cache = gradecache.load_grade_cache(unwritable_path(tmpdir, 'cache', 'grades.pickle'))
+    student = make_student('user', [('hello', '01-01-2017 08:00', 'AC')])
+    gradecache.grade_cache_put(cache, student, resolver.Result())
+    gradecache.save_grade_cache(cache)
+    assert 'Could not save' in capsys.readouterr().err
+    assert cache.changed
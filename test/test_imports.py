@@ -0,0 +1,30 @@
+import os
+import subprocess
+import sys
+import pytest
+
+# Students start main.py many times per session, so the entry points
+# should only import what every run needs. Which modules are loaded is
+# checked rather than how long it takes, which depends on the machine.
+ENTRY_POINTS = [
+    ('main', ['colored', 'requests', 'lxml', 'bs4', 'multiprocessing']),
+    ('scrape', ['colored', 'requests', 'lxml', 'bs4', 'gradecache', 'resolver']),
+    ('submit', ['colored', 'requests', 'lxml', 'bs4', 'gradecache', 'resolver']),
+]
+
+
+def imported_modules(module):
+    # Returns the top level names of the modules loaded by importing
+    # module in a fresh interpreter
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(['src', 'plugins']))
+    code = 'import sys, {}; print(" ".join(sys.modules))'.format(module)
+    process = subprocess.run([sys.executable, '-c', code], env=env, stdout=subprocess.PIPE,
+                             universal_newlines=True, check=True)
+    return set(name.split('.')[0] for name in process.stdout.split())
+
+
+@pytest.mark.parametrize('module,forbidden', ENTRY_POINTS)
+def test_entry_point_imports(module, forbidden):
+    imported = imported_modules(module)
+    assert module in imported
+    assert imported.isdisjoint(forbidden), sorted(imported & set(forbidden))
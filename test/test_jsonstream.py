@@ -0,0 +1,47 @@
+import io
+import json
+import jsonstream
+import pytest
+
+
+def make_stream(content, chunk_size=3):
+    return jsonstream.JsonStream(io.StringIO(content), chunk_size)
+
+
+def test_iterate_array():
+    content = json.dumps([{'a': [1, 2, 3]}, 'text', 12345, [], {}], indent=2)
+    stream = make_stream(content)
+    assert list(stream.iterate_array()) == json.loads(content)
+
+
+def test_iterate_empty():
+    assert list(make_stream('[ ]').iterate_array()) == []
+    assert list(make_stream(' {} ').iterate_object()) == []
+
+
+def test_iterate_object_with_skipping():
+    content = json.dumps({'first': [1, [2]], 'students': [{'x': 1}, {'y': 2}], 'last': 99})
+    stream = make_stream(content, chunk_size=1)
+    found = {}
+    for key in stream.iterate_object():
+        if key == 'students':
+            found[key] = list(stream.iterate_array())
+        elif key == 'first':
+            jsonstream.skip_value(stream)
+        else:
+            found[key] = stream.read_value()
+    assert found == {'students': [{'x': 1}, {'y': 2}], 'last': 99}
+
+
+def test_bad_json():
+    with pytest.raises(ValueError):
+        list(make_stream('[1, 2 3]').iterate_array())
+    with pytest.raises(ValueError):
+        list(make_stream('[1, {"a": ').iterate_array())
+
+
+def test_numbers_split_between_chunks():
+    content = '[1.5e10, 12.25, 3, -0.5E-3, {"a": 7.125}, 100]'
+    for chunk_size in range(1, len(content) + 1):
+        stream = make_stream(content, chunk_size)
+        assert list(stream.iterate_array()) == json.loads(content), chunk_size
@@ -0,0 +1,22 @@
+import kattishtml
+import pytest
+from utiltest import *
+
+
+def test_same_rows_as_soup():
+    html = read_file(get_page_file('submissions.html'))
+    rows = kattishtml.parse_submission_rows(html)
+    assert len(rows) == 400
+    assert rows == parse_with_soup(html)
+    assert rows[0]['submission_id'] == '4000000'
+    assert 'middle' in rows[0]['status']
+
+
+def test_empty_page():
+    html = read_file(get_page_file('submissions_empty.html'))
+    assert kattishtml.parse_submission_rows(html) == []
+
+
+def test_page_without_table():
+    with pytest.raises(kattishtml.PageError):
+        kattishtml.parse_submission_rows('<html><body><p>Please log in</p></body></html>')
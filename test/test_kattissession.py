@@ -0,0 +1,68 @@
+import json
+import kattissession
+import os
+import pytest
+import stat
+import subprocess
+import sys
+from stubserver import StubKattis, make_pages
+
+
+def open_session(stub, cache_path):
+    login = lambda session: session.post(stub.url('/login'), data={'user': 'me'})
+    kattis_session = kattissession.make_kattis_session(
+        kattissession.make_session({}, 2), login, 'me@' + stub.url('/login'), cache_path)
+    return kattis_session, kattissession.session_login(kattis_session)
+
+
+@pytest.mark.timeout(20)
+def test_cached_cookies_skip_the_login(tmpdir):
+    cache_path = str(tmpdir.join('cache', 'cookies.json'))
+    with StubKattis(make_pages(1, 2), require_login=True) as stub:
+        first, response = open_session(stub, cache_path)
+        assert response.status_code == 200
+        assert first.get(stub.url('/users/me?page=0')).status_code == 200
+
+        second, response = open_session(stub, cache_path)
+        assert response is None
+        assert second.get(stub.url('/users/me?page=0')).status_code == 200
+    assert len(stub.posts) == 1
+    assert stat.S_IMODE(os.stat(cache_path).st_mode) == 0o600
+
+
+@pytest.mark.timeout(20)
+def test_refused_request_logs_in_again(tmpdir):
+    cache_path = str(tmpdir.join('cookies.json'))
+    with StubKattis(make_pages(1, 2), require_login=True) as stub:
+        first, _ = open_session(stub, cache_path)
+        # Another login makes the cached cookie stale
+        open_session(stub, None)
+        second, response = open_session(stub, cache_path)
+        assert response is None
+        assert second.get(stub.url('/users/me?page=0')).status_code == 200
+    assert len(stub.posts) == 3
+    with open(cache_path) as f:
+        cookies = list(json.load(f).values())[0]
+    assert [cookie['value'] for cookie in cookies] == ['stub3']
+
+
+def test_expired_cookies_are_not_used(tmpdir):
+    cache_path = str(tmpdir.join('cookies.json'))
+    with open(cache_path, 'w') as f:
+        json.dump({'me': [{'name': 'session', 'value': 'old', 'domain': '', 'path': '/',
+                           'secure': False, 'expires': 1}]}, f)
+    assert kattissession.load_cookies(cache_path, 'me') is None
+    assert kattissession.load_cookies(cache_path, 'other') is None
+
+
+def test_cookie_cache_path_does_not_load_the_grader(tmpdir):
+    # The scraper and submit only need the session, not the grading code
+    code = 'import kattissession, sys; print(kattissession.cookie_cache_path()); ' \
+        'print(" ".join(sys.modules))'
+    env = dict(os.environ, XDG_CACHE_HOME=str(tmpdir),
+               PYTHONPATH=os.pathsep.join(['src', 'plugins']))
+    process = subprocess.run([sys.executable, '-c', code], env=env, stdout=subprocess.PIPE,
+                             universal_newlines=True, check=True)
+    fpath, modules = process.stdout.splitlines()
+    assert fpath == str(tmpdir.join('kattis-cli', 'cookies.json'))
+    assert 'gradecache' not in modules.split()
@@ -0,0 +1,137 @@
+import io
+import tracemalloc
+import gradecache
+import main
+import rules
+from utiltest import *
+
+
+def get_ruleset_from_file(fpath):
+    rule_path = get_rule_file(fpath)
+    return rules.parse_file(rule_path.as_posix())
+
+
+def make_students():
+    return [make_student('user{}'.format(idx),
+                         [(problem, '01-01-2017 07:00', 'AC')
+                          for problem in ['helloworld', 'helloworld2'][:idx % 3]])
+            for idx in range(6)]
+
+
+def goal_points(student_result):
+    return [(goal.id, goal.points) for goal in student_result.result.goals]
+
+
+def test_parallel_grading_keeps_order():
+    ruleset = get_ruleset_from_file('test_uppgift.json')
+    students = make_students()
+
+    program = main.compile_ruleset(ruleset)
+    serial = [main.grade_student(s, ruleset, program, False) for s in students]
+    parallel = list(main.grade_students_in_parallel(students, ruleset, False, 2, 1))
+
+    assert [r.student.username for r in parallel] == [s.username for s in students]
+    assert list(map(goal_points, parallel)) == list(map(goal_points, serial))
+    assert [goal_points(r)[0][1] for r in parallel] == [0, 1, 2, 0, 1, 2]
+
+
+def test_grading_uses_cache(tmpdir, monkeypatch):
+    rule_path = get_rule_file('test_uppgift.json').as_posix()
+    ruleset = rules.parse_file(rule_path)
+    students = make_students()
+    cache = main.open_grade_cache(rule_path, ruleset, str(tmpdir))
+
+    graded = [main.grade_student(s, ruleset, None, False, cache) for s in students]
+    for student_result in graded:
+        gradecache.grade_cache_put(cache, student_result.student, student_result.result)
+    gradecache.save_grade_cache(cache)
+
+    def fail(*args):
+        raise AssertionError('Cached students should not be resolved')
+    monkeypatch.setattr(main.resolver, 'resolve', fail)
+    cache = main.open_grade_cache(rule_path, ruleset, str(tmpdir))
+    cached = [main.grade_student(s, ruleset, None, False, cache) for s in students]
+    assert list(map(goal_points, cached)) == list(map(goal_points, graded))
+    assert list(map(exact_points, cached)) == list(map(exact_points, graded))
+    rule_ids = lambda r: [id(rule) for goal in r.result.goals for rule, _ in goal.resolved_rules]
+    assert list(map(rule_ids, cached)) == list(map(rule_ids, graded))
+
+
+def make_cohort_students():
+    times = ['01-01-2017 06:00', '01-01-2017 07:00', '01-01-2017 08:00']
+    problems = ['testproblem', 'helloworld', 'helloworld2', 'labproblem1']
+    return [make_student('user{}'.format(idx),
+                         [(problem, times[idx % 3], 'AC') for problem in problems[:idx % 5]])
+            for idx in range(9)]
+
+
+def exact_points(student_result):
+    return [(goal.id, repr(goal.points), [repr(points) for _, points in goal.resolved_rules])
+            for goal in student_result.result.goals]
+
+
+def test_cohort_matches_one_at_a_time():
+    students = make_cohort_students()
+    for fname in ['test_after_deadline.json', 'test_uppgift.json', 'test_lab.json']:
+        ruleset = get_ruleset_from_file(fname)
+        program = main.compile_ruleset(ruleset)
+        single = [main.grade_student(s, ruleset, program, False) for s in students]
+        cohort = list(main.grade_students_in_cohorts(students, ruleset, program, size=4))
+        assert [r.student.username for r in cohort] == [s.username for s in students]
+        assert list(map(exact_points, cohort)) == list(map(exact_points, single))
+
+
+def test_cohort_resolves_students_as_they_are_read(monkeypatch):
+    resolved = []
+    resolve_student = main.resolve_student
+    def counting_resolve(student, *args):
+        resolved.append(student.username)
+        return resolve_student(student, *args)
+    monkeypatch.setattr(main, 'resolve_student', counting_resolve)
+    ruleset = get_ruleset_from_file('test_uppgift.json')
+    graded = main.grade_students_in_cohorts(make_students(), ruleset,
+                                            main.compile_ruleset(ruleset), size=4)
+    assert next(graded).student.username == 'user0'
+    assert resolved == ['user0']
+    assert len(list(graded)) == 5
+
+
+def peak_memory(function):
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def test_cache_does_not_hold_every_result(tmpdir):
+    rulepath = get_rule_file('test_uppgift.json').as_posix()
+    problems = ['helloworld', 'helloworld2', 'testproblem']
+    datapath = write_export(tmpdir.join('export.json'),
+                            [('user{}'.format(idx), problems[:idx % 4]) for idx in range(1000)])
+    grade = lambda use_cache: lambda: main.main(
+        rulepath, datapath, name_filter='', use_cache=use_cache,
+        cache_directory=str(tmpdir.join('cache')), stream=io.StringIO())
+    without_cache = peak_memory(grade(False))
+    with_cache = peak_memory(grade(True))
+    # Only the encoded results are kept, about 150 bytes per student where
+    # the results themselves take more than 1000
+    assert with_cache < without_cache + 1000 * 500
+
+
+def test_parallel_grading_with_cache(tmpdir):
+    rulepath = get_rule_file('test_uppgift.json').as_posix()
+    problems = ['helloworld', 'helloworld2', 'testproblem']
+    datapath = write_export(tmpdir.join('export.json'),
+                            [('user{}'.format(idx), problems[:idx % 4]) for idx in range(40)])
+    def grade(jobs, use_cache=True):
+        stream = io.StringIO()
+        main.main(rulepath, datapath, detailed=True, name_filter='', jobs=jobs,
+                  use_cache=use_cache, cache_directory=str(tmpdir.join('cache')),
+                  stream=stream)
+        return stream.getvalue()
+    serial = grade(1, use_cache=False)
+    # First with a cold cache that the results are stored in, then warm
+    assert grade(2) == serial
+    assert grade(2) == serial
@@ -0,0 +1,111 @@
+import csv
+import io
+import json
+import main
+import report
+import rules
+from utiltest import *
+
+
+def grade_students(fname, students):
+    ruleset = rules.parse_file(get_rule_file(fname).as_posix())
+    program = main.compile_ruleset(ruleset)
+    return [main.grade_student(s, ruleset, program, False) for s in students]
+
+
+def make_students():
+    return [
+        make_student('ada', [('helloworld', '01-01-2017 07:00', 'AC')]),
+        make_student('bob', [('helloworld', '01-01-2017 07:00', 'WA')]),
+    ]
+
+
+def test_student_result_to_dict():
+    ada, bob = map(report.student_result_to_dict, grade_students('test_uppgift.json',
+                                                                 make_students()))
+    assert ada['username'] == 'ada'
+    assert [goal['points'] for goal in ada['goals']] == [1]
+    assert [goal['points'] for goal in bob['goals']] == [0]
+    assert 'rules' not in ada['goals'][0]
+
+
+def test_detailed_dict_has_problem_status():
+    graded = grade_students('test_uppgift.json', make_students())
+    ada, bob = [report.student_result_to_dict(r, detailed=True) for r in graded]
+    status = ada['goals'][0]['rules'][0]['problems'][0]
+    assert status['problem'] == 'helloworld'
+    assert status['AC'] and status['attempted']
+    status = bob['goals'][0]['rules'][0]['problems'][0]
+    assert status['attempted'] and not status['AC']
+    assert status['points'] == 0
+
+
+def test_json_writer_writes_one_array():
+    stream = io.StringIO()
+    writer = report.make_writer('json', stream, False)
+    for student_result in grade_students('test_uppgift.json', make_students()):
+        writer.write(student_result)
+    writer.finish()
+    content = json.loads(stream.getvalue())
+    assert [student['username'] for student in content] == ['ada', 'bob']
+
+
+def test_json_writer_without_students():
+    stream = io.StringIO()
+    writer = report.make_writer('json', stream, False)
+    writer.finish()
+    assert json.loads(stream.getvalue()) == []
+
+
+def test_csv_writer_rows():
+    stream = io.StringIO()
+    writer = report.make_writer('csv', stream, True)
+    for student_result in grade_students('test_uppgift.json', make_students()):
+        writer.write(student_result)
+    writer.finish()
+    rows = list(csv.DictReader(io.StringIO(stream.getvalue())))
+    problems = [row for row in rows if row['problem']]
+    assert [(row['username'], row['problem'], row['AC']) for row in problems] == [
+        ('ada', 'helloworld', 'True'), ('ada', 'helloworld2', 'False'),
+        ('bob', 'helloworld', 'False'), ('bob', 'helloworld2', 'False')]
+
+
+class Terminal(io.StringIO):
+
+    def isatty(self):
+        return True
+
+
+def test_colour_follows_the_output_stream(monkeypatch):
+    colored = []
+    as_color = main.as_color
+    def recording_as_color(string, color, use_color=True):
+        colored.append(use_color)
+        return as_color(string, color, False)
+    monkeypatch.setattr(main, 'as_color', recording_as_color)
+
+    def write(fmt, stream):
+        del colored[:]
+        writer = main.make_output_writer(fmt, stream, True)
+        for student_result in grade_students('test_uppgift.json', make_students()):
+            writer.write(student_result)
+        writer.finish()
+        return set(colored)
+    assert write('text', Terminal()) == {True}
+    assert write('text', io.StringIO()) == {False}
+    assert write('json', Terminal()) == set()
+    assert write('csv', Terminal()) == set()
+
+
+def test_totals_are_kept_while_writing():
+    stream = io.StringIO()
+    totals = report.make_totals()
+    writer = report.make_writer('json', stream, False, totals)
+    for student_result in grade_students('test_uppgift.json', make_students()):
+        writer.write(student_result)
+    writer.finish()
+    content = json.loads(stream.getvalue())
+    assert [student['username'] for student in content['students']] == ['ada', 'bob']
+    goal = content['totals']['goals'][0]
+    assert content['totals']['students'] == 2
+    assert (goal['students'], goal['mean'], goal['min'], goal['max']) == (2, 0.5, 0, 1)
@@ -1,3 +1,4 @@
+import json
 import random
 import rules
 import resolver
@@ -53,3 +54,176 @@ def test_custom_plugin():
     result = resolver.resolve(ruleset, context)
     assert len(result.goals) == 1
     assert all(goal.points == 42 for goal in result.goals)
+
+
+def test_compiled_matches_interpreted():
+    rule_path = get_rule_file('test_resolve_with_ordering.json')
+    ruleset = rules.parse_file(rule_path.as_posix())
+
+    context = resolver.make_context()
+    program = resolver.compile_ruleset(ruleset, context)
+    compiled = resolver.resolve(ruleset, context, program)
+    interpreted = resolver.resolve(ruleset, resolver.make_context())
+    assert [(g.id, g.points) for g in compiled.goals] == \
+        [(g.id, g.points) for g in interpreted.goals]
+
+
+def test_compiled_with_other_layout_falls_back():
+    def checker(context, tree):
+        return isinstance(tree, dict) and 'identity' in tree
+    def handler(context, tree):
+        return tree['identity']
+    rule_path = get_rule_file('test_custom_plugin.json')
+    ruleset = rules.parse_file(rule_path.as_posix())
+
+    # Compiled without the plugin, so the program does not fit the context
+    program = resolver.compile_ruleset(ruleset, resolver.make_context())
+    context = resolver.make_context()
+    resolver.context_add_plugin(context, checker, handler)
+    result = resolver.resolve(ruleset, context, program)
+    assert all(goal.points == 42 for goal in result.goals)
+
+
+def test_keyword_plugin_overrides_builtin():
+    context = resolver.make_context()
+    resolver.context_add_keyword_plugin(context, '+', lambda context, tree: 42)
+    assert context.value_expression({'+': [1, 2]}) == 42
+    assert context.value_expression({'-': [3, 2]}) == 1
+
+
+def test_checker_plugin_overrides_keyword_plugin():
+    def checker(context, tree):
+        return isinstance(tree, dict) and '+' in tree
+    context = resolver.make_context()
+    resolver.context_add_keyword_plugin(context, '+', lambda context, tree: 42)
+    resolver.context_add_plugin(context, checker, lambda context, tree: 7)
+    assert context.value_expression({'+': [1, 2]}) == 7
+
+    # The latest registered plugin wins, wherever it is stored
+    resolver.context_add_keyword_plugin(context, '+', lambda context, tree: 3)
+    assert context.value_expression({'+': [1, 2]}) == 3
+
+
+def test_result_goals_by_id():
+    result = resolver.Result()
+    first = resolver.make_goal('first', 'First')
+    second = resolver.make_goal('second', 'Second')
+    resolver.result_add_goal(result, first)
+    resolver.result_add_goal(result, second)
+    resolver.goal_add_points(second, 3)
+
+    assert resolver.result_get_goals(result) == [first, second]
+    assert resolver.result_get_goal(result, 'second') is second
+    assert resolver.result_get_goal_points(result, 'second') == 3
+    assert resolver.result_get_goal_points(result, 'missing') == 0
+
+
+def test_ruleset_order_is_cached():
+    rule_path = get_rule_file('test_resolve_with_ordering.json')
+    ruleset = rules.parse_file(rule_path.as_posix())
+
+    order = resolver.ruleset_order(ruleset)
+    assert sorted(order) == list(range(len(ruleset.rules)))
+    assert order == resolver.topological_order(ruleset.rules)
+    assert resolver.ruleset_order(ruleset) is order
+
+    rules.ruleset_add_rule(ruleset, rules.make_rule(True, 'extra', 1, '', '', ''))
+    assert len(resolver.ruleset_order(ruleset)) == len(ruleset.rules)
+
+
+def make_counting_context(calls, impure=False):
+    def counted(context, tree):
+        calls.append(tree['counted'])
+        return 1
+    counted.impure = impure
+    context = resolver.make_context()
+    resolver.context_add_keyword_plugin(context, 'counted', counted)
+    return context
+
+
+def repeated_ruleset():
+    return rules.parse_string(json.dumps({'rules': [
+        {'towards': 'a', 'points': {'+': [{'counted': 'x'}, {'counted': 'y'}]}},
+        {'towards': 'b', 'points': {'counted': 'x'},
+         'needs': {'>': {'lhs': {'get': 'a'}, 'rhs': 0}}},
+        {'towards': 'c', 'points': {'+': [{'counted': 'x'}, {'get': 'a'}]},
+         'needs': {'>': {'rhs': 0, 'lhs': {'get': 'a'}}}},
+    ]}))
+
+
+def test_repeated_expressions_resolved_once():
+    ruleset = repeated_ruleset()
+    calls = []
+    context = make_counting_context(calls)
+    program = resolver.compile_ruleset(ruleset, context)
+    result = resolver.resolve(ruleset, context, program)
+    assert [(g.id, g.points) for g in result.goals] == [('a', 2), ('b', 1), ('c', 3)]
+    assert sorted(calls) == ['x', 'y']
+
+    # Nothing is kept between students
+    resolver.resolve(ruleset, context, program)
+    assert sorted(calls) == ['x', 'x', 'y', 'y']
+
+
+def test_impure_expressions_are_not_reused():
+    ruleset = repeated_ruleset()
+    program = resolver.compile_ruleset(ruleset, make_counting_context([]))
+    calls = []
+    result = resolver.resolve(ruleset, make_counting_context(calls, impure=True), program)
+    assert [(g.id, g.points) for g in result.goals] == [('a', 2), ('b', 1), ('c', 3)]
+    assert sorted(calls) == ['x', 'x', 'x', 'y']
+
+
+def test_shapes_follow_structure():
+    structures = {}
+    shapes = {}
+    trees = [{'a': 1, 'b': [True]}, {'b': [True], 'a': 1}, {'a': 1, 'b': [1]}]
+    numbers = [resolver.shape_nodes(tree, structures, shapes) for tree in trees]
+    assert numbers[0] == numbers[1] != numbers[2]
+
+
+def test_profile_counts_handlers_and_rules():
+    rule_path = get_rule_file('test_resolve_with_ordering.json')
+    ruleset = rules.parse_file(rule_path.as_posix())
+    profile = resolver.start_profile()
+    try:
+        context = resolver.make_context()
+        result = resolver.resolve(ruleset, context)
+    finally:
+        assert resolver.stop_profile() is profile
+    assert isinstance(context, resolver.ProfilingContext)
+    assert all(goal.points == 1 for goal in result.goals)
+    content = resolver.profile_to_dict(profile)
+    assert sum(rule['calls'] for rule in content['rules']) == 5
+    assert 'get' in [handler['name'] for handler in content['handlers']]
+    assert [phase['name'] for phase in content['phases']] == ['topological_order']
+
+    # Once stopped, contexts are the plain ones again
+    assert type(resolver.make_context()) is resolver.Context
+
+
+def test_profile_counts_memo_hits_apart():
+    ruleset = repeated_ruleset()
+    calls = []
+    profile = resolver.start_profile()
+    try:
+        context = make_counting_context(calls)
+        program = resolver.compile_ruleset(ruleset, context)
+        resolver.resolve(ruleset, context, program)
+    finally:
+        resolver.stop_profile()
+    # x is needed by all three rules, but only resolved the first time
+    assert profile.handlers['counted'][0] == len(calls) == 2
+    assert profile.memo['counted'][0] == 2
+    assert 'memo' in resolver.profile_to_dict(profile)
+
+
+def test_unhandled_expression_resolves_to_none():
+    ruleset = rules.parse_string(json.dumps({'rules': [
+        {'towards': 'a', 'needs': None, 'points': 1},
+        {'towards': 'b', 'points': 1},
+    ]}))
+    program = resolver.compile_ruleset(ruleset, resolver.make_context())
+    for compiled in [None, program]:
+        result = resolver.resolve(ruleset, resolver.make_context(), compiled)
+        assert [(g.id, g.points) for g in result.goals] == [('a', 0), ('b', 1)]
@@ -0,0 +1,48 @@
+import os
+import rulecache
+import rules
+from utiltest import *
+
+
+def included_points(ruleset):
+    return [rule.points for rule in ruleset.rules if rule.towards == 'included']
+
+
+def test_artifact_is_used_on_warm_runs(tmpdir, monkeypatch):
+    rulepath, included = write_rules(tmpdir, 1)
+    cache = str(tmpdir.join('cache'))
+    ruleset, files = rulecache.load_ruleset(rulepath, cache)
+    assert included_points(ruleset) == [1]
+    assert 'order' in ruleset.cache
+    assert sorted(files) == sorted(map(os.path.abspath, [rulepath, included]))
+
+    def fail(*args):
+        raise AssertionError('The rules should come from the artifact')
+    monkeypatch.setattr(rules, 'parse_file', fail)
+    ruleset, _ = rulecache.load_ruleset(rulepath, cache)
+    assert included_points(ruleset) == [1]
+
+    # Touching a file does not change the rules
+    os.utime(included, ns=(2 * 10 ** 18, 2 * 10 ** 18))
+    ruleset, _ = rulecache.load_ruleset(rulepath, cache)
+    assert included_points(ruleset) == [1]
+
+
+def test_artifact_is_rebuilt_when_an_include_changes(tmpdir):
+    rulepath, included = write_rules(tmpdir, 1)
+    cache = str(tmpdir.join('cache'))
+    rulecache.load_ruleset(rulepath, cache)
+    write_rules(tmpdir, 2)
+    os.utime(included, ns=(3 * 10 ** 18 // 2, 3 * 10 ** 18 // 2))
+    ruleset, _ = rulecache.load_ruleset(rulepath, cache)
+    assert included_points(ruleset) == [2]
+
+
+def test_unwritable_cache_directory_is_skipped(tmpdir, monkeypatch, capsys):
+    monkeypatch.setattr(rulecache, 'warned_unwritable', False)
+    rulepath, _ = write_rules(tmpdir, 1)
+    cache = unwritable_path(tmpdir, 'cache')
+    for _ in range(2):
+        ruleset, _ = rulecache.load_ruleset(rulepath, cache)
+        assert included_points(ruleset) == [1]
+    assert capsys.readouterr().err.count('Could not store') == 1
@@ -1,3 +1,4 @@
+import os
 import rules
 import pytest
 from utiltest import *
@@ -119,3 +120,19 @@ def test_inspect_complex_rule():
     assert rule.needs == need_expression
     assert rule.towards == "inspect-complex-towards"
     assert rule.points == value_expression
+
+
+def test_each_file_parsed_once(monkeypatch):
+    loaded = []
+    load = rules.json.load
+    def counting_load(f):
+        loaded.append(f.name)
+        return load(f)
+    monkeypatch.setattr(rules.json, 'load', counting_load)
+
+    parsed = {}
+    rule_path = get_rule_file('test_load_circular_import_1.json')
+    ruleset = rules.parse_file(rule_path.as_posix(), parsed)
+    assert len(ruleset.rules) == 2
+    assert sorted(loaded) == sorted(set(loaded))
+    assert sorted(parsed) == sorted(os.path.abspath(fpath) for fpath in loaded)
@@ -0,0 +1,87 @@
+import pytest
+import scrape
+from stubserver import StubKattis, make_pages
+
+
+def profile_url(stub):
+    return lambda idx: stub.url('/users/me?page={}'.format(idx))
+
+
+@pytest.mark.timeout(20)
+def test_scrape_pages_in_order():
+    pages = make_pages(7, 5)
+    with StubKattis(pages) as stub:
+        session = scrape.make_session(3)
+        rows = scrape.scrape_pages(session, profile_url(stub), concurrency=3)
+
+    assert len(rows) == 35
+    assert [row['problem_id'] for row in rows] == \
+        ['problem{}'.format(sid % 7) for sid in range(35, 0, -1)]
+    assert 'accepted' in rows[0]['status']
+    # Only a few pages past the end are requested before it is found
+    requested = [int(path.split('=')[-1]) for path in stub.requests]
+    assert max(requested) < 7 + 3
+
+
+@pytest.mark.timeout(20)
+def test_scrape_pages_retries():
+    pages = make_pages(2, 3)
+    with StubKattis(pages, failures={'/users/me?page=1': 2}) as stub:
+        session = scrape.make_session(2)
+        rows = scrape.scrape_pages(session, profile_url(stub), concurrency=2, backoff=0.01)
+
+    assert len(rows) == 6
+    assert stub.requests.count('/users/me?page=1') == 3
+
+
+@pytest.mark.timeout(20)
+def test_scrape_pages_gives_up():
+    pages = make_pages(2, 3)
+    with StubKattis(pages, failures={'/users/me?page=0': 10}) as stub:
+        session = scrape.make_session(2)
+        with pytest.raises(scrape.ScrapeError):
+            scrape.scrape_pages(session, profile_url(stub), concurrency=2,
+                                retries=2, backoff=0.01)
+
+
+@pytest.mark.timeout(20)
+def test_scrape_since_last():
+    pages = make_pages(6, 4)
+    with StubKattis(pages) as stub:
+        session = scrape.make_session(4)
+        everything = scrape.scrape_pages(session, profile_url(stub), concurrency=4)
+        # Pretend the first six submissions are new since the last download
+        stored = scrape.merge_submissions([], everything[6:])
+        stub.requests.clear()
+
+        known_ids = set(s['id'] for s in stored)
+        has_known = lambda rows: any(row['submission_id'] in known_ids for row in rows)
+        collected = scrape.scrape_pages(session, profile_url(stub), concurrency=4,
+                                        is_last_page=has_known, initial_concurrency=1)
+
+    requested = [int(path.split('=')[-1]) for path in stub.requests]
+    assert max(requested) <= 2
+    assert len(collected) == 8
+    merged = scrape.merge_submissions(stored, collected)
+    assert merged == scrape.merge_submissions([], everything)
+
+
+def test_stored_submissions(tmpdir):
+    fpath = str(tmpdir.join('data.json'))
+    assert scrape.read_stored_submissions(fpath) is None
+
+    rows = [{'submission_id': '2', 'problem_id': 'b', 'problem_name': 'B',
+             'status': ['accepted'], 'time': '2017-01-02 08:00:00'},
+            {'submission_id': '1', 'problem_id': 'a', 'problem_name': 'A',
+             'status': ['rejected'], 'time': '08:00:00'}]
+    scrape.write_export(fpath, scrape.submissions_to_export(rows))
+    stored = scrape.read_stored_submissions(fpath)
+    assert [s['id'] for s in stored] == ['2', '1']
+    assert stored[1]['judgement'] == 'Wrong Answer'
+    assert '-' in stored[1]['time']
+
+    # Files from before the ids were kept can not be continued from
+    export = scrape.submissions_to_export(rows)
+    del export['students'][0]['submissions'][0]['id']
+    scrape.write_export(fpath, export)
+    assert scrape.read_stored_submissions(fpath) is None
@@ -0,0 +1,68 @@
+import configparser
+import pytest
+import submit
+from stubserver import StubKattis
+
+
+def make_config(stub):
+    cfg = configparser.ConfigParser()
+    cfg.read_dict({
+        'user': {'username': 'me', 'token': 'secret'},
+        'kattis': {'loginurl': stub.url('/login'), 'submissionurl': stub.url('/submit')},
+        'defaults': {'python-version': '3'},
+    })
+    return cfg
+
+
+def write_files(tmpdir, names):
+    for name in names:
+        tmpdir.join(name).write('solution of {}\n'.format(name))
+
+
+def test_read_batch_from_directory(tmpdir):
+    write_files(tmpdir, ['hello.py', 'Carrots.java', 'util.h', 'notes.txt'])
+    submissions, unknown = submit.read_batch(str(tmpdir), configparser.ConfigParser())
+    assert [(problem, language, mainclass) for problem, language, mainclass, _ in submissions] \
+        == [('Carrots', 'Java', 'Carrots'), ('hello', 'Python 3', 'hello')]
+    assert unknown == [str(tmpdir.join('notes.txt'))]
+
+
+def test_read_batch_from_manifest(tmpdir):
+    write_files(tmpdir, ['a.cpp', 'b.c'])
+    tmpdir.join('manifest').write('# deadline today\na.cpp helloworld\n\nb.c\n')
+    submissions, unknown = submit.read_batch(str(tmpdir.join('manifest')), None)
+    assert submissions == [('helloworld', 'C++', None, [str(tmpdir.join('a.cpp'))]),
+                           ('b', 'C', None, [str(tmpdir.join('b.c'))])]
+    assert unknown == []
+
+
+def test_guess_submission_keeps_given_language():
+    cfg = configparser.ConfigParser()
+    cfg.read_dict({'defaults': {'python-version': '4'}})
+    assert submit.guess_submission('dir/Carrots.java', cfg, 'carrots') \
+        == ('carrots', 'Java', 'Carrots', ['dir/Carrots.java'])
+    # The configured Python version is only needed when it is guessed
+    assert submit.guess_submission('hello.py', cfg, language='PyPy')[1] == 'PyPy'
+    with pytest.raises(submit.ConfigError):
+        submit.guess_submission('hello.py', cfg)
+    assert submit.guess_submission('notes.txt', cfg)[1] is None
+
+
+@pytest.mark.timeout(20)
+def test_submit_batch_logs_in_once(tmpdir):
+    names = ['p{}.cpp'.format(idx) for idx in range(6)]
+    write_files(tmpdir, names)
+    with StubKattis([], require_login=True) as stub:
+        cfg = make_config(stub)
+        submissions, _ = submit.read_batch(str(tmpdir), cfg)
+        session, login_reply = submit.open_kattis_session(cfg, use_cookie_cache=False,
+                                                          pool_size=3)
+        assert login_reply.status_code == 200
+        results = submit.submit_batch(session, stub.url('/submit'), submissions, 3)
+
+    assert [submission[0] for submission, _, _ in results] == ['p{}'.format(i) for i in range(6)]
+    ids = [submission_id for _, submission_id, _ in results]
+    assert None not in ids and len(set(ids)) == 6
+    paths = [path for path, _ in stub.posts]
+    assert paths.count('/login') == 1 and paths.count('/submit') == 6
+    assert any(b'solution of p3.cpp' in body for _, body in stub.posts)
@@ -1,3 +1,7 @@
+import aaps
+import json
+import os
+from bs4 import BeautifulSoup
 from pathlib import Path
 
 def read_file(fpath, mode='r'):
@@ -12,3 +16,67 @@ def get_rule_directory():
 
 def get_rule_file(fname):
     return get_rule_directory() / fname
+
+
+def get_page_directory():
+    return Path('test') / 'pages'
+
+
+def get_page_file(fname):
+    return get_page_directory() / fname
+
+
+def parse_with_soup(html):
+    # How the rows were read before, with a soup for the whole page
+    soup = BeautifulSoup(html, 'lxml')
+    table = soup.find_all('table', class_='table-submissions')[0]
+    rows = table.find_all('tbody')[0].find_all('tr')
+
+    def process_row(row):
+        data_items = row.find_all('td')
+        return {
+            'submission_id': data_items[0].text.strip(),
+            'problem_id': data_items[2].a['href'].split('/')[-1],
+            'problem_name': data_items[2].a.text,
+            'status': data_items[3]['class'],
+            'time': data_items[1].text
+        }
+    return [process_row(row) for row in rows]
+
+
+def make_student(username, submissions, name=None):
+    student = aaps.make_student(username, name or username.capitalize())
+    for problem, time, result in submissions:
+        aaps.student_add_submission(student, aaps.make_submission(problem, time, result))
+    return student
+
+
+def write_export(fpath, students, mtime=None):
+    content = {'students': [
+        {'username': username, 'name': username.capitalize(), 'submissions': [
+            {'problem': problem, 'judgement': 'Accepted', 'time': '2017-01-01 07:00:00'}
+            for problem in problems
+        ]} for username, problems in students
+    ]}
+    fpath.write(json.dumps(content))
+    # Make sure the change is seen even within the resolution of the clock
+    if mtime is not None:
+        os.utime(str(fpath), ns=(mtime, mtime))
+    return str(fpath)
+
+
+def write_rules(directory, points):
+    included = directory.join('included.json')
+    included.write(json.dumps({'rules': [{'towards': 'included', 'points': points}]}))
+    main = directory.join('main.json')
+    main.write(json.dumps({'includes': [str(included)], 'rules': [{'towards': 'main'}]}))
+    # Older than the build so that the rule cache stores its artifact
+    for fpath in [included, main]:
+        os.utime(str(fpath), ns=(10 ** 18, 10 ** 18))
+    return str(main), str(included)
+
+
+def unwritable_path(directory, *parts):
+    # A directory can not be made inside a regular file
+    directory.join('file').write('')
+    return str(directory.join('file', *parts))